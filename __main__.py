@@ -1,11 +1,69 @@
+import argparse
+import sys
+from typing import Optional
+from pygb.apu import APU, AudioSink, WaveFileSink
 from pygb.motherboard import Motherboard
+from pygb.ppu import RawFileVideoSink, VideoSink
+from pygb.profiler import Profiler
+from pygb.trace import FileTracer, RingTracer, Tracer
+
+
+def create_tracer(args) -> Optional[Tracer]:
+    if args.trace == 'ring':
+        return RingTracer(size=args.trace_size)
+    if args.trace == 'file':
+        return FileTracer(path=args.trace_file)
+    return None
+
+
+def create_audio_sink(args) -> Optional[AudioSink]:
+    if args.audio_file:
+        return WaveFileSink(path=args.audio_file, sample_rate=APU.sample_rate, channels=APU.channels)
+    return None
+
+
+def create_video_sink(args) -> Optional[VideoSink]:
+    if args.video_file:
+        return RawFileVideoSink(path=args.video_file)
+    return None
+
+
+def write_profile(args, profiler: Optional[Profiler]):
+    if profiler is None:
+        return
+    if args.profile:
+        with open(args.profile, 'w') as stream:
+            profiler.dump_json(stream)
+    if args.profile_collapsed:
+        with open(args.profile_collapsed, 'w') as stream:
+            profiler.dump_collapsed(stream, weight='time')
+
 
 if __name__ == '__main__':
-    motherboard = Motherboard()
+    parser = argparse.ArgumentParser(prog='pygb')
+    parser.add_argument('rom', nargs='?', help='cartridge rom to load, an empty slot when left out')
+    parser.add_argument('--trace', choices=['off', 'ring', 'file'], default='off',
+                        help='record executed instructions, which runs every one through the interpreter')
+    parser.add_argument('--trace-size', type=int, default=4096, help='instructions kept by the ring tracer')
+    parser.add_argument('--trace-file', default='trace.log', help='log written by the file tracer')
+    parser.add_argument('--headless', action='store_true', help='run without sdl, audio and video are discarded')
+    parser.add_argument('--boot', choices=['full', 'fast'],
+                        help='run the boot rom or start at 0x0100 in the post-boot state, fast when headless')
+    parser.add_argument('--audio-file', help='write audio to this wav file instead of the sound device')
+    parser.add_argument('--video-file', help='append every frame to this file as raw 160x144 shades')
+    parser.add_argument('--profile', help='profile every instruction and write the counters to this json file')
+    parser.add_argument('--profile-collapsed', help='write the profile as collapsed stacks for flamegraph tools')
+    args = parser.parse_args()
+    motherboard = Motherboard(tracer=create_tracer(args), headless=args.headless,
+                              audio_sink=create_audio_sink(args), video_sink=create_video_sink(args),
+                              fast_boot=None if args.boot is None else args.boot == 'fast', rom=args.rom)
+    if args.profile or args.profile_collapsed:
+        motherboard.cpu.start_profiling()
     try:
         motherboard.run()
     except Exception as e:
+        motherboard.tracer.dump(sys.stdout)
         print("ERROR: ", str(e))
     finally:
+        write_profile(args, motherboard.cpu.stop_profiling())
         motherboard.close()
-
@@ -0,0 +1,75 @@
+import time
+from benchmarks.roms import PROGRAM_START
+from pygb.motherboard import Motherboard
+from typing import Dict, Optional
+
+CLOCK_HZ = 4194304
+BOOT_END = 0x0100
+# a few seconds of emulated time, far longer than the boot rom takes to hand over
+BOOT_CYCLES = 4 * CLOCK_HZ
+
+
+def create_motherboard(*, rom: Optional[str], recompile: bool, fast_boot: bool) -> Motherboard:
+    motherboard = Motherboard(headless=True, fast_boot=fast_boot, rom=rom, recompile=recompile)
+    if fast_boot:
+        # the synthetic roms have no header worth running through, their code starts right after it
+        motherboard.cpu.reg_pc = PROGRAM_START
+    return motherboard
+
+
+def run_workload(motherboard: Motherboard, *, cycles: Optional[int]) -> str:
+    # without a cycle budget the boot rom runs until it hands over to the cartridge, capped in case it never does
+    try:
+        if cycles is not None:
+            return motherboard.run_for(cycles=cycles)
+        stop = motherboard.run_until(pc=BOOT_END, cycles=BOOT_CYCLES)
+        return f'pc 0x{BOOT_END:04X}' if stop == Motherboard.STOP_PC else f'{stop} 0x{motherboard.cpu.reg_pc:04X}'
+    except Exception as e:
+        # the boot rom still reaches opcodes that are not implemented, where it stops is part of the result
+        return f'error at 0x{motherboard.cpu.reg_pc:04X}: {e}'
+
+
+def count_instructions(*, rom: Optional[str], cycles: Optional[int]) -> int:
+    # the same run through the interpreter with every tick counted, skipped idle loops count for nothing
+    # just as they cost nothing. recompiled blocks retire the same instructions but may overshoot the end by a block
+    motherboard = create_motherboard(rom=rom, recompile=False, fast_boot=cycles is not None)
+    cpu = motherboard.cpu
+    tick, instructions = cpu.tick, 0
+
+    def counted_tick():
+        nonlocal instructions
+        instructions += 1
+        tick()
+
+    cpu.tick = counted_tick
+    try:
+        run_workload(motherboard, cycles=cycles)
+    finally:
+        motherboard.close()
+    return instructions
+
+
+def result(*, instructions: int, cycles: int, seconds: float, stop: str) -> Dict[str, object]:
+    seconds = max(seconds, 1e-12)
+    return {
+        'instructions': instructions,
+        'cycles': cycles,
+        'seconds': seconds,
+        'instructions_per_second': instructions / seconds,
+        'cycles_per_second': cycles / seconds,
+        'realtime': cycles / seconds / CLOCK_HZ,
+        'stop': stop,
+    }
+
+
+def benchmark(*, rom: Optional[str], cycles: Optional[int], recompile: bool, repeat: int) -> Dict[str, object]:
+    instructions = count_instructions(rom=rom, cycles=cycles)
+    best, ticks, stop = float('inf'), 0, ''
+    for _ in range(repeat):
+        motherboard = create_motherboard(rom=rom, recompile=recompile, fast_boot=cycles is not None)
+        start = time.perf_counter()
+        stop = run_workload(motherboard, cycles=cycles)
+        best = min(best, time.perf_counter() - start)
+        ticks = motherboard.ticks
+        motherboard.close()
+    return result(instructions=instructions, cycles=ticks, seconds=best, stop=stop)
@@ -0,0 +1,142 @@
+import time
+from benchmarks.roms import PROGRAM_START, build_rom
+from pygb.instructions import CB_PREFIX, EI, Instruction, OPCODES
+from pygb.motherboard import Motherboard
+from typing import Callable, Dict
+
+# operands following every opcode, a d16 in vram and an a8 on a plain io register
+OPERANDS = bytes([0x42, 0x98])
+# room for the opcode, its operands and a cb suffix
+SLOT_SIZE = 4
+
+
+def measure(run: Callable[[int], None], *, number: int, repeat: int) -> float:
+    # best of several runs, the least disturbed one is closest to the real cost
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(number)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(seconds: float, *, number: int) -> Dict[str, float]:
+    return {'ops': number, 'seconds': seconds, 'ops_per_second': number / seconds, 'ns_per_op': seconds * 1e9 / number}
+
+
+def opcode_rom() -> bytes:
+    program = bytearray()
+    for opcode in range(0x100):
+        program += bytes([opcode]) + OPERANDS + bytes([0x00])
+    for opcode in range(0x100):
+        program += bytes([CB_PREFIX.opcode, opcode]) + OPERANDS
+    return build_rom(program=bytes(program))
+
+
+def bus_benchmarks(motherboard: Motherboard, *, number: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    bus = motherboard.bus
+    read8, write8 = bus.read8, bus.write8
+    results = {}
+
+    def reader(address: int):
+        def run(count: int):
+            for _ in range(count):
+                read8(address)
+        return run
+
+    def writer(address: int, value: int):
+        def run(count: int):
+            for _ in range(count):
+                write8(address, value)
+        return run
+
+    cases = {
+        'bus.read8.rom': reader(PROGRAM_START),
+        'bus.read8.vram': reader(0x8000),
+        'bus.read8.io': reader(0xFF42),
+        'bus.write8.vram': writer(0x8000, 0x55),
+        'bus.write8.cart': writer(0x2000, 0x01),
+        'bus.write8.io': writer(0xFF42, 0x10),
+    }
+    for name, run in cases.items():
+        results[name] = result(measure(run, number=number, repeat=repeat), number=number)
+
+    def legacy_read(count: int):
+        for _ in range(count):
+            bus.read(address=0x8000, size=16)
+
+    def legacy_write(count: int):
+        value = bytes(16)
+        for _ in range(count):
+            bus.write(address=0x8000, value=value)
+
+    # the legacy api moves 16 bytes per call, reported per byte
+    for name, run in (('bus.read.vram16', legacy_read), ('bus.write.vram16', legacy_write)):
+        results[name] = result(measure(run, number=number // 16, repeat=repeat), number=number // 16 * 16)
+    return results
+
+
+def fetch_benchmark(motherboard: Motherboard, *, number: int, repeat: int) -> Dict[str, float]:
+    cpu = motherboard.cpu
+    fetch_next = cpu.fetch_next
+
+    def run(count: int):
+        # restarted every page so the pc never leaves the rom
+        for _ in range(count // 0x100):
+            cpu.reg_pc = PROGRAM_START
+            for _ in range(0x100):
+                fetch_next()
+
+    number = max(number - number % 0x100, 0x100)
+    return result(measure(run, number=number, repeat=repeat), number=number)
+
+
+def io_benchmarks(motherboard: Motherboard, *, number: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    write8 = motherboard.bus.write8
+    cases = {
+        'io.write8.plain': (0xFF42, 0x10),
+        'io.write8.joypad': (0xFF00, 0x20),
+        'io.write8.apu_register': (0xFF12, 0xF3),
+        'io.write8.apu_trigger': (0xFF14, 0x87),
+        'io.write8.stat': (0xFF41, 0x40),
+    }
+    results = {}
+    for name, (address, value) in cases.items():
+        def run(count: int, address=address, value=value):
+            for _ in range(count):
+                write8(address, value)
+        results[name] = result(measure(run, number=number, repeat=repeat), number=number)
+    return results
+
+
+def dispatch_benchmarks(motherboard: Motherboard, *, number: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    cpu = motherboard.cpu
+    fetch_next = cpu.fetch_next
+
+    def reset(address: int):
+        # every instruction starts from the same state so none of them drifts out of its memory region
+        cpu.reg_pc = address
+        cpu.reg_a = 0x55
+        cpu.reg_bc = cpu.reg_de = cpu.reg_hl = 0x9800
+        cpu.reg_c = 0x42
+
+    def baseline(count: int):
+        for _ in range(count):
+            reset(PROGRAM_START)
+            fetch_next()
+
+    # reported on its own rather than subtracted, a difference of two noisy timings can come out at zero or below
+    results = {'dispatch.baseline': result(measure(baseline, number=number, repeat=repeat), number=number)}
+    for slot, prefix, instructions in ((0, '', Instruction.instructions), (0x100, 'CB', CB_PREFIX.instructions)):
+        for opcode, instruction in sorted(instructions.items()):
+            # cb opcodes are measured with their prefix byte, the way the interpreter runs them, and ei
+            # runs the byte after it, which in its slot is an operand
+            if isinstance(instruction, (CB_PREFIX, EI)):
+                continue
+            def run(count: int, address=PROGRAM_START + (slot + opcode) * SLOT_SIZE):
+                for _ in range(count):
+                    reset(address)
+                    OPCODES[fetch_next()](cpu)
+            seconds = measure(run, number=number, repeat=repeat)
+            results[f'dispatch.{prefix}{opcode:02X}.{instruction.name}'] = result(seconds, number=number)
+    return results
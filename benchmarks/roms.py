@@ -0,0 +1,44 @@
+import os
+from typing import Dict
+
+ROM_SIZE = 0x8000
+PROGRAM_START = 0x0150
+CART_TYPE = 0x0147
+ROM_ONLY = 0x00
+MBC1 = 0x01
+
+# programs placed at PROGRAM_START, each one loops forever using only implemented opcodes
+PROGRAMS: Dict[str, bytes] = {
+    # inc e; inc c; jr nz,-4; inc c; jr nz,-7
+    'alu_loop': bytes([0x1C, 0x0C, 0x20, 0xFC, 0x0C, 0x20, 0xF9]),
+    # ld a,0x55; ld hl,0x9fff; ld (hl-),a; bit 7,h; jr nz,-5; ld c,0x00; inc c; jr nz,-15
+    'store_loop': bytes([0x3E, 0x55, 0x21, 0xFF, 0x9F, 0x32, 0xCB, 0x7C, 0x20, 0xFB,
+                         0x0E, 0x00, 0x0C, 0x20, 0xF1]),
+    # ld bc,0x2000; ld a,0x01; ld (bc),a; ld a,0x02; ld (bc),a; inc c; jr nz,-9; inc c; jr nz,-12
+    'bank_switch_loop': bytes([0x01, 0x00, 0x20, 0x3E, 0x01, 0x02, 0x3E, 0x02, 0x02, 0x0C, 0x20, 0xF7,
+                               0x0C, 0x20, 0xF4]),
+    # ldh (0x42),a; ld (c),a; inc e; jr nz,-6; inc e; jr nz,-9, c is left at nr13 by the boot rom
+    'io_loop': bytes([0xE0, 0x42, 0xE2, 0x1C, 0x20, 0xFA, 0x1C, 0x20, 0xF7]),
+    # ldh a,(0x44); cp 0x90; jr nz,-6; ldh a,(0x44); cp 0x00; jr nz,-6; inc c; jr nz,-15; inc c; jr nz,-18,
+    # waits for vblank and then for the next frame the way games do
+    'idle_loop': bytes([0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA, 0xF0, 0x44, 0xFE, 0x00, 0x20, 0xFA,
+                        0x0C, 0x20, 0xF1, 0x0C, 0x20, 0xEE]),
+}
+
+CART_TYPES = {'bank_switch_loop': MBC1}
+
+
+def build_rom(*, program: bytes, cart_type: int=ROM_ONLY) -> bytes:
+    rom = bytearray(ROM_SIZE)
+    rom[CART_TYPE] = cart_type
+    rom[PROGRAM_START:PROGRAM_START + len(program)] = program
+    return bytes(rom)
+
+
+def write_roms(*, directory: str) -> Dict[str, str]:
+    paths = {}
+    for name, program in PROGRAMS.items():
+        paths[name] = os.path.join(directory, f'{name}.gb')
+        with open(paths[name], 'wb') as rom_file:
+            rom_file.write(build_rom(program=program, cart_type=CART_TYPES.get(name, ROM_ONLY)))
+    return paths
@@ -0,0 +1,81 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import os
+from benchmarks import macro, micro
+from benchmarks.roms import write_roms
+from pygb.motherboard import Motherboard
+
+
+def run_micro(args, directory: str) -> dict:
+    path = os.path.join(directory, 'opcodes.gb')
+    with open(path, 'wb') as rom_file:
+        rom_file.write(micro.opcode_rom())
+    motherboard = Motherboard(headless=True, rom=path)
+    try:
+        results = micro.bus_benchmarks(motherboard, number=args.number, repeat=args.repeat)
+        results['cpu.fetch_next'] = micro.fetch_benchmark(motherboard, number=args.number, repeat=args.repeat)
+        results.update(micro.io_benchmarks(motherboard, number=args.number, repeat=args.repeat))
+        results.update(micro.dispatch_benchmarks(motherboard, number=args.number, repeat=args.repeat))
+    finally:
+        motherboard.close()
+    return results
+
+
+def run_macro(args, directory: str) -> dict:
+    workloads = {'boot_rom': (None, None)}
+    workloads.update((name, (path, args.cycles)) for name, path in write_roms(directory=directory).items())
+    results = {}
+    for name, (rom, cycles) in workloads.items():
+        results[name] = {
+            mode: macro.benchmark(rom=rom, cycles=cycles, recompile=mode == 'recompiled', repeat=args.repeat)
+            for mode in ('interpreted', 'recompiled')
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    # speed of this run relative to the baseline, above 1.0 is faster
+    for name, entry in results['micro'].items():
+        if name in baseline.get('micro', {}):
+            print(f'{name:48} {entry["ops_per_second"] / baseline["micro"][name]["ops_per_second"]:6.2f}x')
+    for name, modes in results['macro'].items():
+        for mode, entry in modes.items():
+            old = baseline.get('macro', {}).get(name, {}).get(mode)
+            if old is not None:
+                print(f'{name + "." + mode:48} {entry["cycles_per_second"] / old["cycles_per_second"]:6.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='benchmarks')
+    parser.add_argument('--output', help='write the results to this json file instead of stdout')
+    parser.add_argument('--compare', help='json file of an earlier run to print speed ratios against')
+    parser.add_argument('--number', type=int, default=20000, help='operations per microbenchmark')
+    parser.add_argument('--cycles', type=int, default=1048576, help='emulated cycles per synthetic rom')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest is kept')
+    parser.add_argument('--skip', choices=['micro', 'macro'], action='append', default=[])
+    args = parser.parse_args()
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'settings': {'number': args.number, 'cycles': args.cycles, 'repeat': args.repeat},
+        'micro': {},
+        'macro': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        if 'micro' not in args.skip:
+            results['micro'] = run_micro(args, directory)
+        if 'macro' not in args.skip:
+            results['macro'] = run_macro(args, directory)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
@@ -1,13 +1,108 @@
-from sdl2 import *
+import struct
+import wave
 from ctypes import *
+from functools import partial
+import numpy as np
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.io import IO
+    from pygb.scheduler import Scheduler
+
+
+class AudioRing:
+
+    def __init__(self, *, capacity: int):
+        self.capacity = capacity
+        # every sample is stored twice, capacity bytes apart, so any read of up
+        # to capacity bytes is contiguous and the device side is one memmove
+        self._buffer = (c_int8 * (capacity * 2))()
+        self._samples = np.frombuffer(self._buffer, dtype=np.int8)
+        # running byte counts; only the emulation thread moves _written and
+        # only the audio thread moves _read, so neither side needs a lock
+        self._written = 0
+        self._read = 0
+        self.underruns = 0
+        self.overruns = 0
+
+    @property
+    def available(self) -> int:
+        return self._written - self._read
+
+    def write(self, samples: np.ndarray):
+        count = len(samples)
+        if count > self.capacity - self.available:
+            self.overruns += 1
+            return
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)
+        rest = count - first
+        self._samples[start: start + first] = samples[:first]
+        self._samples[self.capacity + start: self.capacity + start + first] = samples[:first]
+        if rest:
+            self._samples[:rest] = samples[first:]
+            self._samples[self.capacity: self.capacity + rest] = samples[first:]
+        self._written += count
+
+    def read_into(self, buffer, length: int):
+        count = min(self.available, length)
+        address = cast(buffer, c_void_p).value
+        if count:
+            memmove(address, addressof(self._buffer) + self._read % self.capacity, count)
+            self._read += count
+        if count < length:
+            memset(address + count, 0, length - count)
+            self.underruns += 1
+
+
+class AudioSink:
+    # discards everything, used when nothing should be heard
+    underruns = 0
+    overruns = 0
+
+    def write(self, frames: np.ndarray):
+        pass
+
+    def close(self):
+        pass
+
+
+class WaveFileSink(AudioSink):
+
+    def __init__(self, *, path: str, sample_rate: int, channels: int):
+        self._file = wave.open(path, 'wb')
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(1)
+        self._file.setframerate(sample_rate)
+
+    def write(self, frames: np.ndarray):
+        # wav stores 8 bit samples unsigned
+        self._file.writeframes((frames.astype(np.int16) + 128).astype(np.uint8).tobytes())
+
+    def close(self):
+        self._file.close()
 
 
 class APU:
 
     sample_rate = 44100
-    buffer_size = 512
+    channels = 2
+    # samples per channel synthesized by each scheduled event
+    block_size = 128
+    cpu_frequency = 4194304
+
+    # sound registers as offsets from 0xFF00
+    IO_REGISTERS = {
+        0x11: 'nr11', 0x12: 'nr12', 0x13: 'nr13', 0x14: 'nr14',
+        0x16: 'nr21', 0x17: 'nr22', 0x18: 'nr23', 0x19: 'nr24',
+        0x24: 'nr50', 0x25: 'nr51', 0x26: 'nr52',
+    }
 
-    def __init__(self):
+    # registers in IO_REGISTERS order, the next block's cycle, then the state of sounds 1 and 2
+    state_struct = struct.Struct('<11Bd?BdII?BdII')
+
+    def __init__(self, *, scheduler: "Scheduler", io: "IO", sink: AudioSink=None):
+        self._scheduler = scheduler
+        self._sink = sink
         self._sound_1 = Sound1()
         self._sound_2 = Sound2()
         self._sound_3 = Sound3()
@@ -20,28 +115,78 @@ class APU:
         self._reg_nr50 = 0x00
         self._reg_nr11 = 0x00
         self._reg_nr12 = 0x00
-        self._init_sdl()
-
-    def _init_sdl(self):
-        if SDL_Init(SDL_INIT_AUDIO) < 0:
-            print('Audio initialization failed')
-        channels = 2
-        callback = SDL_AudioCallback(lambda userdata, buffer, length: self._sdl_callback(userdata, buffer, length))
-        self.want_audio_spec = SDL_AudioSpec(self.sample_rate, AUDIO_S8, channels, self.buffer_size, callback=callback)
-        self.have_audio_spec = SDL_AudioSpec(0, 0, 0, 0)
-        self.audio_device = SDL_OpenAudioDevice(None, 0, self.want_audio_spec, self.have_audio_spec, 0)
-        SDL_PauseAudioDevice(self.audio_device, 0)
-
-    def _sdl_callback(self, userdata, buffer, length):
-        for i in range(length):
-            buffer[i] = 0
-
-    def _close_sdl(self):
-        SDL_CloseAudioDevice(self.audio_device)
-        SDL_Quit()
+        self._reg_nr13 = 0x00
+        self._reg_nr14 = 0x00
+        self._reg_nr21 = 0x00
+        self._reg_nr22 = 0x00
+        self._reg_nr23 = 0x00
+        self._reg_nr24 = 0x00
+        self._block_cycles = self.block_size * self.cpu_frequency / self.sample_rate
+        self._next_block = self._block_cycles
+        for address, name in self.IO_REGISTERS.items():
+            io.register(address=address, write=partial(setattr, self, name))
+        io.register(address=0x26, read=self._read_nr52)
+        self._block_event = None
+        # without a sink nothing would hear the samples, so none are made
+        if sink is not None:
+            self._block_event = self._scheduler.schedule(at=int(self._next_block), callback=self._synthesize)
+
+    @property
+    def underruns(self) -> int:
+        return self._sink.underruns if self._sink is not None else 0
+
+    @property
+    def overruns(self) -> int:
+        return self._sink.overruns if self._sink is not None else 0
+
+    def _read_nr52(self) -> int:
+        # power bit, unused bits read as 1, then whether each sound is playing
+        playing = 0
+        for bit, sound in enumerate((self._sound_1, self._sound_2)):
+            if sound.enabled and sound.playing:
+                playing |= 1 << bit
+        return (self._reg_nr52 & 0b10000000) | 0b01110000 | playing
+
+    def get_state(self) -> tuple:
+        registers = tuple(getattr(self, name) for name in self.IO_REGISTERS.values())
+        return registers + (self._next_block,) + self._sound_1.get_state() + self._sound_2.get_state()
+
+    def set_state(self, state: tuple):
+        for name, value in zip(self.IO_REGISTERS.values(), state[:11]):
+            # the setters rebuild the sounds' settings, without the trigger bit that would restart them
+            setattr(self, name, value & 0x7F if name in ('nr14', 'nr24') else value)
+        self._reg_nr14, self._reg_nr24 = state[3], state[7]
+        self._next_block = state[11]
+        self._sound_1.set_state(state[12:17])
+        self._sound_2.set_state(state[17:22])
+        if self._block_event is not None:
+            self._scheduler.cancel(self._block_event)
+            self._block_event = self._scheduler.schedule(at=int(self._next_block), callback=self._synthesize)
+
+    def _synthesize(self, at: int):
+        self._sink.write(self.mix(self.block_size))
+        self._next_block += self._block_cycles
+        self._block_event = self._scheduler.schedule(at=int(self._next_block), callback=self._synthesize)
+
+    def mix(self, count: int) -> np.ndarray:
+        left = np.zeros(count, dtype=np.int16)
+        right = np.zeros(count, dtype=np.int16)
+        if self._reg_nr52 & 0b10000000:
+            for sound in (self._sound_1, self._sound_2, self._sound_3, self._sound_4):
+                samples = sound.generate(count, self.sample_rate)
+                if sound.channel_1_enabled:
+                    right += samples
+                if sound.channel_2_enabled:
+                    left += samples
+        # four channels of -15..15 scaled by the 1..8 master volume fit in a signed byte
+        frames = np.empty(count * self.channels, dtype=np.int8)
+        frames[0::2] = left * (self.channel_2_volume + 1) // 4
+        frames[1::2] = right * (self.channel_1_volume + 1) // 4
+        return frames
 
     def close(self):
-        self._close_sdl()
+        if self._sink is not None:
+            self._sink.close()
 
     # sound on/off controller
     @property
@@ -68,6 +213,36 @@ class APU:
     def nr12(self):
         return self._reg_nr12
 
+    # sound 1 frequency low bits
+    @property
+    def nr13(self):
+        return self._reg_nr13
+
+    # sound 1 frequency high bits, length enable and trigger
+    @property
+    def nr14(self):
+        return self._reg_nr14
+
+    # sound 2 sound length/wave pattern
+    @property
+    def nr21(self):
+        return self._reg_nr21
+
+    # sound 2 volume envelop
+    @property
+    def nr22(self):
+        return self._reg_nr22
+
+    # sound 2 frequency low bits
+    @property
+    def nr23(self):
+        return self._reg_nr23
+
+    # sound 2 frequency high bits, length enable and trigger
+    @property
+    def nr24(self):
+        return self._reg_nr24
+
     @nr50.setter
     def nr50(self, value):
         self._reg_nr50 = value
@@ -111,6 +286,45 @@ class APU:
         self._sound_1.envelop_direction = (self._reg_nr12 & 0b00001000) >> 3
         self._sound_1.envelop_volume = self._reg_nr12 >> 4
 
+    @nr13.setter
+    def nr13(self, value):
+        self._reg_nr13 = value
+        self._sound_1.frequency = (self._sound_1.frequency & 0x700) | value
+
+    @nr14.setter
+    def nr14(self, value):
+        self._reg_nr14 = value
+        self._sound_1.frequency = ((value & 0b00000111) << 8) | (self._sound_1.frequency & 0xFF)
+        self._sound_1.length_enabled = bool(value & 0b01000000)
+        if value & 0b10000000:
+            self._sound_1.trigger(self.sample_rate)
+
+    @nr21.setter
+    def nr21(self, value):
+        self._reg_nr21 = value
+        self._sound_2.sound_length = self._reg_nr21 & 0b00111111
+        self._sound_2.wave_pattern = self._reg_nr21 >> 6
+
+    @nr22.setter
+    def nr22(self, value):
+        self._reg_nr22 = value
+        self._sound_2.envelop_sweep = self._reg_nr22 & 0b00000111
+        self._sound_2.envelop_direction = (self._reg_nr22 & 0b00001000) >> 3
+        self._sound_2.envelop_volume = self._reg_nr22 >> 4
+
+    @nr23.setter
+    def nr23(self, value):
+        self._reg_nr23 = value
+        self._sound_2.frequency = (self._sound_2.frequency & 0x700) | value
+
+    @nr24.setter
+    def nr24(self, value):
+        self._reg_nr24 = value
+        self._sound_2.frequency = ((value & 0b00000111) << 8) | (self._sound_2.frequency & 0xFF)
+        self._sound_2.length_enabled = bool(value & 0b01000000)
+        if value & 0b10000000:
+            self._sound_2.trigger(self.sample_rate)
+
 
 class Sound:
 
@@ -126,9 +340,19 @@ class Sound:
         self.channel_1_enabled = False
         self.channel_2_enabled = False
 
+    def generate(self, count: int, sample_rate: int) -> np.ndarray:
+        return np.zeros(count, dtype=np.int16)
+
 
 class Sound1(Sound):
 
+    # playing, volume, phase, envelope clock and remaining length
+    state_struct = struct.Struct('<?BdII')
+
+    # wave_patterns unpacked into one +1/-1 level per duty step
+    duty_levels = np.array([[1 if (pattern >> (7 - step)) & 1 else -1 for step in range(8)]
+                            for _, pattern in sorted(Sound.wave_patterns.items())], dtype=np.int16)
+
     def __init__(self):
         super().__init__()
         self.envelop_sweep = 0
@@ -136,9 +360,52 @@ class Sound1(Sound):
         self.envelop_volume = 0
         self.sound_length = 0
         self.wave_pattern = 0
-
-
-class Sound2(Sound):
+        self.frequency = 0
+        self.length_enabled = False
+        self.playing = False
+        self._volume = 0
+        self._phase = 0.0
+        self._envelope_clock = 0
+        self._length_samples = 0
+
+    def get_state(self) -> tuple:
+        return self.playing, self._volume, self._phase, self._envelope_clock, self._length_samples
+
+    def set_state(self, state: tuple):
+        self.playing, self._volume, self._phase, self._envelope_clock, self._length_samples = state
+
+    def trigger(self, sample_rate: int):
+        self.playing = True
+        self._volume = self.envelop_volume
+        self._envelope_clock = 0
+        self._length_samples = (64 - self.sound_length) * sample_rate // 256
+
+    def generate(self, count: int, sample_rate: int) -> np.ndarray:
+        if not (self.enabled and self.playing):
+            return np.zeros(count, dtype=np.int16)
+        steps_per_sample = 8 * 131072 / (2048 - self.frequency) / sample_rate
+        phases = self._phase + steps_per_sample * np.arange(count)
+        self._phase = (self._phase + steps_per_sample * count) % 8
+        samples = self.duty_levels[self.wave_pattern][phases.astype(np.int64) % 8]
+        if self.envelop_sweep:
+            period = sample_rate * self.envelop_sweep // 64
+            steps = (self._envelope_clock + np.arange(count)) // period
+            direction = 1 if self.envelop_direction else -1
+            samples = samples * np.clip(self._volume + direction * steps, 0, 15)
+            elapsed_steps = (self._envelope_clock + count) // period
+            self._envelope_clock = (self._envelope_clock + count) % period
+            self._volume = min(15, max(0, self._volume + direction * elapsed_steps))
+        else:
+            samples = samples * self._volume
+        if self.length_enabled:
+            if count >= self._length_samples:
+                samples[self._length_samples:] = 0
+                self.playing = False
+            self._length_samples = max(0, self._length_samples - count)
+        return samples
+
+
+class Sound2(Sound1):
 
     def __init__(self):
         super().__init__()
@@ -159,4 +426,4 @@ class Sound4(Sound):
 class Sound5(Sound):
 
     def __init__(self):
-        super().__init__()
+        super().__init__()
\ No newline at end of file
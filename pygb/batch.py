@@ -0,0 +1,148 @@
+import math
+import multiprocessing
+import os
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from pygb.apu import APU, AudioSink
+from pygb.motherboard import Motherboard
+from pygb.ppu import PPU
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+FRAME_CYCLES = PPU.LINES * PPU.LINE_CYCLES
+FRAME_SIZE = PPU.HEIGHT * PPU.WIDTH
+
+
+class Job:
+
+    def __init__(self, *, rom: str, frames: int, inputs: Sequence[Tuple[int, str, bool]]=(), fast_boot: bool=True):
+        self.rom = rom
+        self.frames = frames
+        # (frame, button, pressed) applied before the frame runs
+        self.inputs = sorted(inputs, key=lambda event: event[0])
+        self.fast_boot = fast_boot
+
+    @property
+    def audio_size(self) -> int:
+        # every sample the apu can produce in the job's cycles, plus the block that may straddle the end
+        samples = math.ceil(self.frames * FRAME_CYCLES * APU.sample_rate / APU.cpu_frequency) + APU.block_size
+        return samples * APU.channels
+
+
+class SharedAudioSink(AudioSink):
+    # appends into a preallocated buffer, samples past its end are dropped and counted
+
+    def __init__(self, *, buffer: np.ndarray):
+        self._buffer = buffer
+        self.size = 0
+
+    def write(self, frames: np.ndarray):
+        count = min(len(frames), len(self._buffer) - self.size)
+        self._buffer[self.size:self.size + count] = frames[:count]
+        self.size += count
+        self.overruns += len(frames) - count
+
+    def close(self):
+        # lets go of the shared memory, which cannot be closed while a view on it is alive
+        self._buffer = None
+
+
+class BatchResult:
+
+    def __init__(self, *, job: Job, memory: shared_memory.SharedMemory):
+        self.job = job
+        self._memory = memory
+        self.framebuffer = np.ndarray((PPU.HEIGHT, PPU.WIDTH), dtype=np.uint8, buffer=memory.buf)
+        self._audio = np.ndarray((job.audio_size,), dtype=np.int8, buffer=memory.buf, offset=FRAME_SIZE)
+        self.audio_size = 0
+        self.ticks = 0
+        self.frame_count = 0
+        self.error: str = None
+
+    @property
+    def audio(self) -> np.ndarray:
+        # interleaved left and right, views into shared memory until the result is closed
+        return self._audio[:self.audio_size]
+
+    def close(self):
+        # views have to go before the block can be released
+        self.framebuffer = self._audio = None
+        self._memory.close()
+        self._memory.unlink()
+
+
+def _run_job(task: Tuple[int, Job, str]) -> Tuple[int, Dict[str, object]]:
+    index, job, name = task
+    memory = shared_memory.SharedMemory(name=name)
+    framebuffer = np.ndarray((PPU.HEIGHT, PPU.WIDTH), dtype=np.uint8, buffer=memory.buf)
+    sink = SharedAudioSink(buffer=np.ndarray((job.audio_size,), dtype=np.int8, buffer=memory.buf, offset=FRAME_SIZE))
+    motherboard, error = None, None
+    try:
+        motherboard = Motherboard(headless=True, fast_boot=job.fast_boot, audio_sink=sink, rom=job.rom)
+        joypad, inputs = motherboard.joypad, iter(job.inputs)
+        event = next(inputs, None)
+        for frame in range(job.frames):
+            while event is not None and event[0] <= frame:
+                _, button, pressed = event
+                if pressed:
+                    joypad.press(button)
+                else:
+                    joypad.release(button)
+                event = next(inputs, None)
+            motherboard.run_for(cycles=FRAME_CYCLES)
+    except Exception as e:
+        # a rom that cannot load or an unimplemented opcode ends only this job, what ran until then is still a result
+        error = str(e)
+    finally:
+        try:
+            if motherboard is not None:
+                motherboard.close()
+                framebuffer[:] = motherboard.ppu.framebuffer
+        finally:
+            sink.close()
+            del framebuffer
+            memory.close()
+    if motherboard is None:
+        return index, {'audio_size': 0, 'ticks': 0, 'frame_count': 0, 'error': error}
+    return index, {'audio_size': sink.size, 'ticks': motherboard.ticks,
+                   'frame_count': motherboard.ppu.frame_count, 'error': error}
+
+
+class BatchRunner:
+
+    def __init__(self, *, workers: int=None):
+        self._workers = workers or os.cpu_count()
+        # workers share the parent's tracker, one of their own would unlink every block it saw on exit
+        resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(self._workers)
+
+    def __enter__(self) -> "BatchRunner":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, jobs: Iterable[Job]) -> List[BatchResult]:
+        # each job gets its own block, workers write pixels and samples straight into it and only
+        # a few counters travel back through the pool
+        results = []
+        try:
+            for job in jobs:
+                memory = shared_memory.SharedMemory(create=True, size=FRAME_SIZE + job.audio_size)
+                results.append(BatchResult(job=job, memory=memory))
+            tasks = [(index, result.job, result._memory.name) for index, result in enumerate(results)]
+            for index, summary in self._pool.imap_unordered(_run_job, tasks):
+                result = results[index]
+                result.audio_size = summary['audio_size']
+                result.ticks = summary['ticks']
+                result.frame_count = summary['frame_count']
+                result.error = summary['error']
+        except BaseException:
+            # nobody gets the results, so their blocks would outlive the batch
+            for result in results:
+                result.close()
+            raise
+        return results
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -1,12 +1,97 @@
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.cart import Cart
+    from pygb.cpu import CPU
+    from pygb.interrupts import Interrupts
+    from pygb.io import IO
+    from pygb.timer import Timer
+    from pygb.vram import VRAM
+
+
 class Boot:
 
+    # dmg register values at 0x0100 once the boot rom has run
+    POST_BOOT_REGISTERS = {
+        'af': 0x01B0,
+        'bc': 0x0013,
+        'de': 0x00D8,
+        'hl': 0x014D,
+        'sp': 0xFFFE,
+        'pc': 0x0100,
+    }
+
+    # io register values left by the boot rom, as offsets from 0xFF00
+    POST_BOOT_IO = {
+        0x00: 0xCF, 0x01: 0x00, 0x02: 0x7E, 0x04: 0xAB, 0x05: 0x00, 0x06: 0x00, 0x07: 0xF8,
+        0x10: 0x80, 0x11: 0xBF, 0x12: 0xF3, 0x13: 0xFF, 0x14: 0xBF, 0x16: 0x3F, 0x17: 0x00, 0x18: 0xFF,
+        0x19: 0xBF, 0x1A: 0x7F, 0x1B: 0xFF, 0x1C: 0x9F, 0x1D: 0xFF, 0x1E: 0xBF, 0x20: 0xFF, 0x21: 0x00,
+        0x22: 0x00, 0x23: 0xBF, 0x24: 0x77, 0x25: 0xF3, 0x26: 0xF1, 0x40: 0x91, 0x41: 0x85, 0x42: 0x00,
+        0x43: 0x00, 0x44: 0x00, 0x45: 0x00, 0x46: 0xFF, 0x47: 0xFC, 0x48: 0xFF, 0x49: 0xFF, 0x4A: 0x00,
+        0x4B: 0x00,
+    }
+
+    # requests left pending in if, the vblank of the last boot rom frame
+    POST_BOOT_INTERRUPTS = 0x01
+
+    # internal counter behind div at 0x0100, div itself reads its upper byte
+    POST_BOOT_DIVIDER = 0xABCC
+
+    # writes the boot rom makes that peripherals have to see, in boot rom order
+    BOOT_IO_WRITES = [(0x26, 0x80), (0x11, 0x80), (0x12, 0xF3), (0x25, 0xF3), (0x24, 0x77), (0x47, 0xFC),
+                      (0x42, 0x00), (0x40, 0x91)]
+
+    LOGO_START = 0x0104
+    LOGO_SIZE = 48
+    LOGO_TILES = 0x0010
+    REGISTERED_TILE = 0x0190
+    REGISTERED_MARK = bytes([0x3C, 0x42, 0xB9, 0xA5, 0xB9, 0xA5, 0x42, 0x3C])
+    # tile map positions of the two logo rows and the registered mark
+    LOGO_TOP_ROW = 0x1904
+    LOGO_BOTTOM_ROW = 0x1924
+    REGISTERED_MAP = 0x1910
+
     def __init__(self, *, path):
         self._path = path
         self._content: bytearray = bytearray()
 
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._content)
+
     def load_boot(self):
         with open(self._path, "rb") as boot_file:
             self._content = bytearray(boot_file.read())
 
     def read_boot(self, *, address: int, size: int=1) -> bytearray:
         return self._content[address: address + size]
+
+    @staticmethod
+    def _scale_nibble(nibble: int) -> int:
+        # every logo pixel is drawn two pixels wide
+        value = 0
+        for bit in range(3, -1, -1):
+            value = (value << 2) | (0b11 if (nibble >> bit) & 1 else 0)
+        return value
+
+    def apply_post_boot_state(self, *, cpu: "CPU", io: "IO", vram: "VRAM", cart: "Cart", timer: "Timer",
+                              interrupts: "Interrupts"):
+        for register, value in self.POST_BOOT_REGISTERS.items():
+            setattr(cpu, f'reg_{register}', value)
+        for address, value in self.POST_BOOT_IO.items():
+            io.poke8(address, value)
+        for address, value in self.BOOT_IO_WRITES:
+            io.write8(address, value)
+        timer.reset_divider(counter=self.POST_BOOT_DIVIDER)
+        interrupts.request(self.POST_BOOT_INTERRUPTS)
+        # the cartridge logo, scaled up and doubled vertically, on the first plane only
+        tiles = bytearray()
+        for byte in cart.read(address=self.LOGO_START, size=self.LOGO_SIZE):
+            for nibble in (byte >> 4, byte & 0x0F):
+                row = self._scale_nibble(nibble)
+                tiles += bytes([row, 0x00, row, 0x00])
+        vram.write(address=self.LOGO_TILES, value=tiles)
+        mark = bytes(byte for row in self.REGISTERED_MARK for byte in (row, 0x00))
+        vram.write(address=self.REGISTERED_TILE, value=mark)
+        vram.write(address=self.LOGO_TOP_ROW, value=bytes(range(0x01, 0x0D)))
+        vram.write(address=self.LOGO_BOTTOM_ROW, value=bytes(range(0x0D, 0x19)))
+        vram.write(address=self.REGISTERED_MAP, value=bytes([0x19]))
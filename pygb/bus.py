@@ -1,7 +1,11 @@
+import struct
+from typing import Callable, Dict, List, Optional
 from pygb.boot import Boot
-from pygb.cart import Cart
+from pygb.cart import Cart, CartRAM
 from pygb.vram import VRAM
 from pygb.io import IO
+from pygb.oam import OAM
+from pygb.wram import WRAM
 
 
 class Bus:
@@ -10,48 +14,347 @@ class Bus:
     SWITHCABLE_BANK_START = 0x4000
     VRAM_START = 0x8000
     EXRAM_START = 0xA000
+    WRAM_START = 0xC000
+    ECHO_START = 0xE000
+    OAM_START = 0xFE00
     IO_START = 0xFF00
     HRAM_START = 0xFF80
+    BOOT_DISABLE = 0xFF50
+    OAM_DMA = 0xFF46
+    OAM_DMA_SIZE = 0xA0
 
-    def __init__(self, *, boot: Boot, vram: VRAM, cart: Cart, io: IO):
+    state_struct = struct.Struct('<?')
+
+    # code banks of cart ram are numbered from here, past any rom bank
+    EXRAM_BANK_BASE = 0x10000
+
+    PAGE_SHIFT = 8
+    PAGE_SIZE = 0x100
+    PAGE_COUNT = 0x100
+
+    def __init__(self, *, boot: Boot, vram: VRAM, cart: Cart, io: IO, oam: OAM, wram: WRAM):
         self._boot_enabled = boot is not None
         self._boot = boot
         self._vram = vram
         self._cart = cart
         self._io = io
+        self._oam = oam
+        self._wram = wram
+        # a page either points straight at its backing buffer or, when it is
+        # None, is served by the handler registered for that page
+        self._read_pages: List[Optional[memoryview]] = [None] * self.PAGE_COUNT
+        self._write_pages: List[Optional[memoryview]] = [None] * self.PAGE_COUNT
+        self._read_handlers: List[Callable[[int], int]] = [self._unmapped_read] * self.PAGE_COUNT
+        self._write_handlers: List[Callable[[int, int], None]] = [self._unmapped_write] * self.PAGE_COUNT
+        # storage behind handler pages that have any, what peek reads there instead of calling the handler
+        self._peek_pages: List[Optional[memoryview]] = [None] * self.PAGE_COUNT
+        # handlers taking a whole run of bytes at once, for handler pages that have one
+        self._block_writers: List[Optional[Callable[[int, memoryview], None]]] = [None] * self.PAGE_COUNT
+        # original write entries of pages whose writes are reported, followed by their watchers
+        self._watched: Dict[int, list] = {}
+        # page views of every rom bank mapped so far, so a bank switch is a single slice assignment
+        self._rom_bank_pages: Dict[int, List[memoryview]] = {}
+        self._ram_bank_pages: Dict[int, List[memoryview]] = {}
+        self._exram_base = 0
+        self._exram_mask = 0
+        self._map_memory()
+        io.register(address=self.BOOT_DISABLE - self.IO_START, write=self._write_boot_disable)
+        io.register(address=self.OAM_DMA - self.IO_START, write=self._write_oam_dma)
 
-    def read(self, *, address: int, size: int=1) -> bytearray:
+    def _map_memory(self):
+        # writes to the rom area program the cartridge's bank controller
+        self.map_handlers(start=0x0000, end=self.VRAM_START, write=self._write_to_cart)
+        self._map_rom()
+        self._map_exram()
+        self.map_pages(start=self.VRAM_START, end=self.EXRAM_START, memory=self._vram.memory)
+        # tile data writes go through VRAM so the decoded tile cache can be invalidated
+        self.map_handlers(start=self.VRAM_START, end=self.VRAM_START + VRAM.TILE_DATA_END, write=self._write_to_vram,
+                          write_block=self._write_block_to_vram)
+        self.map_pages(start=self.WRAM_START, end=self.ECHO_START, memory=self._wram.memory)
+        # echo ram mirrors the start of wram
+        self.map_pages(start=self.ECHO_START, end=self.OAM_START, memory=self._wram.memory)
+        self.map_pages(start=self.OAM_START, end=self.IO_START, memory=self._oam.memory)
+        # as do oam writes, for the ppu's index of sprites on each line
+        self.map_handlers(start=self.OAM_START, end=self.IO_START, write=self._write_to_oam,
+                          write_block=self._write_block_to_oam)
+        self.map_handlers(start=self.IO_START, end=0x10000, read=self._read_from_io, write=self._write_to_io,
+                          write_block=self._write_block_to_io)
+        # hram and ie are plain storage there, registers kept by a peripheral read back as last written
+        self._peek_pages[self.IO_START >> self.PAGE_SHIFT] = self._io.memory
+
+    def _rom_pages(self, bank: int) -> List[memoryview]:
+        pages = self._rom_bank_pages.get(bank)
+        if pages is None:
+            memory = self._cart.bank(bank)
+            pages = self._rom_bank_pages[bank] = [memory[offset: offset + self.PAGE_SIZE]
+                                                  for offset in range(0, Cart.BANK_SIZE, self.PAGE_SIZE)]
+        return pages
+
+    def _map_rom(self):
+        bank_pages = Cart.BANK_SIZE >> self.PAGE_SHIFT
+        self._read_pages[0: bank_pages] = self._rom_pages(self._cart.rom_bank_0)
+        self._read_pages[bank_pages: 2 * bank_pages] = self._rom_pages(self._cart.rom_bank)
+        if self._boot_enabled:
+            self._read_pages[0] = self._boot.memory[0: self.PAGE_SIZE]
+
+    def _map_exram(self):
+        cart = self._cart
+        if cart.ram is None or not cart.mbc.ram_enabled:
+            self.map_handlers(start=self.EXRAM_START, end=self.WRAM_START, read=self._read_disabled_exram,
+                              write=self._write_disabled_exram)
+            return
+        memory = cart.ram.bank(cart.mbc.ram_bank)
+        # offset of the mapped bank within the cart ram, for the write handler
+        self._exram_base = (cart.mbc.ram_bank % cart.ram.bank_count) * CartRAM.BANK_SIZE
+        self._exram_mask = len(memory) - 1
+        pages = self._ram_bank_pages.get(cart.mbc.ram_bank)
+        if pages is None:
+            # banks smaller than the area, like 2 KiB carts, repeat through it
+            pages = self._ram_bank_pages[cart.mbc.ram_bank] = [
+                memory[offset % len(memory): offset % len(memory) + self.PAGE_SIZE]
+                for offset in range(0, self.WRAM_START - self.EXRAM_START, self.PAGE_SIZE)]
+        self._read_pages[self.EXRAM_START >> self.PAGE_SHIFT: self.WRAM_START >> self.PAGE_SHIFT] = pages
+        # writes go through the cart ram so it knows which pages to flush
+        self.map_handlers(start=self.EXRAM_START, end=self.WRAM_START, write=self._write_to_exram)
+
+    def map_pages(self, *, start: int, end: int, memory: memoryview, writable: bool=True):
+        for address in range(start, end, self.PAGE_SIZE):
+            page = address >> self.PAGE_SHIFT
+            offset = address - start
+            self._read_pages[page] = memory[offset: offset + self.PAGE_SIZE]
+            write_page = memory[offset: offset + self.PAGE_SIZE] if writable else None
+            self._block_writers[page] = None
+            if page in self._watched:
+                # still watched, the new mapping takes effect once the watchers are gone
+                self._watched[page][0] = write_page
+            else:
+                self._write_pages[page] = write_page
+
+    def map_handlers(self, *, start: int, end: int, read: Callable[[int], int]=None,
+                     write: Callable[[int, int], None]=None, write_block: Callable[[int, memoryview], None]=None):
+        for address in range(start, end, self.PAGE_SIZE):
+            page = address >> self.PAGE_SHIFT
+            if read is not None:
+                self._read_pages[page] = None
+                self._read_handlers[page] = read
+            if write is None:
+                continue
+            self._block_writers[page] = write_block
+            if page in self._watched:
+                self._watched[page][0:2] = [None, write]
+            else:
+                self._write_pages[page] = None
+                self._write_handlers[page] = write
+
+    def _write_boot_disable(self, value: int):
+        self.disable_boot()
+
+    def _write_oam_dma(self, value: int):
+        # finishes at once, the cpu is not locked out of the bus for the 160 cycles it really takes
+        self.transfer(source=value << 8, destination=self.OAM_START, size=self.OAM_DMA_SIZE)
+
+    def get_state(self) -> tuple:
+        return (self._boot_enabled,)
+
+    def set_state(self, state: tuple):
+        (boot_enabled,) = state
+        if boot_enabled and self._boot is None:
+            raise Exception('State was saved during the boot rom, which this bus was created without')
+        # the bank controller has been restored by now, the mapping follows it
+        self._boot_enabled = boot_enabled
+        self._map_rom()
+        self._map_exram()
+
+    def disable_boot(self):
+        if not self._boot_enabled:
+            return
+        self._boot_enabled = False
+        self._read_pages[0] = self._rom_pages(self._cart.rom_bank_0)[0]
+
+    def code_bank(self, address: int) -> int:
         if address < self.ENTRY_POINT and self._boot_enabled:
-            return self._read_from_boot(address=address, size=size)
+            return -1
         if address < self.SWITHCABLE_BANK_START:
-            return self._read_from_cart(address=address, size=size)
-        if self.VRAM_START <= address < self.EXRAM_START:
-            return self._read_from_vram(address=address, size=size)
-        if self.IO_START <= address < self.HRAM_START:
-            return self._read_from_io(address=address, size=size)
+            return self._cart.rom_bank_0
+        if address < self.VRAM_START:
+            return self._cart.rom_bank
+        if self.EXRAM_START <= address < self.WRAM_START:
+            # switching the cart ram bank remaps it without a write, so the bank has to be part of the key
+            cart = self._cart
+            if cart.ram is None or not cart.mbc.ram_enabled:
+                return self.EXRAM_BANK_BASE - 1
+            return self.EXRAM_BANK_BASE + cart.mbc.ram_bank % cart.ram.bank_count
+        return 0
+
+    def watch_writes(self, *, page: int, onwrite: Callable[[int], None]):
+        # rom only changes through bank switching, which code_bank already tells apart
+        if page < self.VRAM_START >> self.PAGE_SHIFT:
+            return
+        entry = self._watched.get(page)
+        if entry is not None:
+            if onwrite not in entry[2]:
+                entry[2].append(onwrite)
+            return
+        entry = self._watched[page] = [self._write_pages[page], self._write_handlers[page], [onwrite]]
+
+        def write(address: int, value: int):
+            # picked up before the watchers run, they may unwatch the page
+            memory, handler, watchers = entry
+            for watcher in tuple(watchers):
+                watcher(address)
+            if memory is None:
+                return handler(address, value)
+            memory[address & 0xFF] = value
+
+        self._write_pages[page] = None
+        self._write_handlers[page] = write
+
+    def unwatch_writes(self, *, page: int, onwrite: Callable[[int], None]):
+        entry = self._watched.get(page)
+        if entry is None or onwrite not in entry[2]:
+            return
+        entry[2].remove(onwrite)
+        if not entry[2]:
+            del self._watched[page]
+            self._write_pages[page], self._write_handlers[page] = entry[0], entry[1]
+
+    def _unmapped_read(self, address: int) -> int:
         raise Exception(f'0x{address:04X} is not A Valid Address')
 
-    def _read_from_boot(self, *, address: int, size: int) -> bytearray:
-        return self._boot.read_boot(address=address, size=size)
+    def _unmapped_write(self, address: int, value: int):
+        raise Exception(f'Write to 0x{address:04X} is not allowed')
+
+    def _write_to_cart(self, address: int, value: int):
+        cart = self._cart
+        mbc = cart.mbc
+        rom_bank_0, rom_bank, ram_bank, ram_enabled = mbc.rom_bank_0, mbc.rom_bank, mbc.ram_bank, mbc.ram_enabled
+        cart.write8(address, value)
+        if mbc.rom_bank != rom_bank or mbc.rom_bank_0 != rom_bank_0:
+            self._map_rom()
+        if mbc.ram_bank != ram_bank or mbc.ram_enabled != ram_enabled:
+            self._map_exram()
+
+    def _read_disabled_exram(self, address: int) -> int:
+        return 0xFF
 
-    def _read_from_cart(self, *, address: int, size: int) -> bytearray:
-        return self._cart.read(address=address, size=size)
+    def _write_disabled_exram(self, address: int, value: int):
+        pass
 
-    def _read_from_vram(self, *, address: int, size: int) -> bytearray:
-        return self._vram.read(address=address - self.VRAM_START, size=size)
+    def _write_to_exram(self, address: int, value: int):
+        self._cart.ram.write8(self._exram_base + ((address - self.EXRAM_START) & self._exram_mask), value)
 
-    def _write_to_vram(self, *, address: int, value: bytes):
+    def _write_to_vram(self, address: int, value: int):
+        self._vram.write8(address - self.VRAM_START, value)
+
+    def _write_block_to_vram(self, address: int, value: memoryview):
         self._vram.write(address=address - self.VRAM_START, value=value)
 
-    def _read_from_io(self, *, address: int, size: int) -> bytearray:
-        return self._io.read(address=address - self.IO_START, size=size)
+    def _write_to_oam(self, address: int, value: int):
+        self._oam.write8(address - self.OAM_START, value)
+
+    def _write_block_to_oam(self, address: int, value: memoryview):
+        self._oam.write(address=address - self.OAM_START, value=value)
+
+    def _read_from_io(self, address: int) -> int:
+        return self._io.read8(address - self.IO_START)
+
+    def _write_to_io(self, address: int, value: int):
+        self._io.write8(address - self.IO_START, value)
 
-    def _write_to_io(self, *, address: int, value: bytes):
+    def _write_block_to_io(self, address: int, value: memoryview):
         self._io.write(address=address - self.IO_START, value=value)
 
+    def read8(self, address: int) -> int:
+        page = self._read_pages[address >> 8]
+        if page is None:
+            return self._read_handlers[address >> 8](address)
+        return page[address & 0xFF]
+
+    def peek8(self, address: int) -> int:
+        # reads without going through handlers, pages with no storage behind them read as 0xFF
+        page = self._read_pages[address >> 8]
+        if page is None:
+            page = self._peek_pages[address >> 8]
+            if page is None:
+                return 0xFF
+        return page[address & 0xFF]
+
+    def peek(self, *, address: int, size: int) -> bytes:
+        # a page at a time, with the same storage as peek8
+        chunks = []
+        end = address + size
+        while address < end:
+            page = self._read_pages[address >> 8]
+            if page is None:
+                page = self._peek_pages[address >> 8]
+            count = min(end, (address | 0xFF) + 1) - address
+            if page is None:
+                chunks.append(b'\xFF' * count)
+            else:
+                chunks.append(page[address & 0xFF:(address & 0xFF) + count])
+            address += count
+        return b''.join(chunks)
+
+    def read16(self, address: int) -> int:
+        return self.read8(address) | (self.read8((address + 1) & 0xFFFF) << 8)
+
+    def write8(self, address: int, value: int):
+        page = self._write_pages[address >> 8]
+        if page is None:
+            return self._write_handlers[address >> 8](address, value)
+        page[address & 0xFF] = value
+
+    def read(self, *, address: int, size: int=1) -> bytearray:
+        # a slice per mapped page, handler pages are read a byte at a time
+        data = bytearray()
+        end = address + size
+        while address < end:
+            page = self._read_pages[address >> 8]
+            count = min(end, (address | 0xFF) + 1) - address
+            if page is None:
+                handler = self._read_handlers[address >> 8]
+                data += bytes(handler(current_address) for current_address in range(address, address + count))
+            else:
+                data += page[address & 0xFF:(address & 0xFF) + count]
+            address += count
+        return data
+
     def write(self, *, address: int, value: bytes):
-        if self.VRAM_START <= address < self.EXRAM_START:
-            return self._write_to_vram(address=address, value=value)
-        if self.IO_START <= address < self.HRAM_START:
-            return self._write_to_io(address=address, value=value)
-        raise Exception(f'Write to 0x{address:04X} is not allowed' )
+        # a slice per page as well, watchers hear about each page once before it changes and handler
+        # pages with a block writer get the whole run in one call
+        value = memoryview(value)
+        offset = 0
+        while offset < len(value):
+            page = address >> 8
+            count = min(len(value) - offset, self.PAGE_SIZE - (address & 0xFF))
+            chunk = value[offset:offset + count]
+            entry = self._watched.get(page)
+            if entry is None:
+                memory, handler = self._write_pages[page], self._write_handlers[page]
+            else:
+                for watcher in tuple(entry[2]):
+                    watcher(address)
+                memory, handler = entry[0], entry[1]
+            if memory is not None:
+                memory[address & 0xFF:(address & 0xFF) + count] = chunk
+            elif self._block_writers[page] is not None:
+                self._block_writers[page](address, chunk)
+            else:
+                for index, byte in enumerate(chunk):
+                    handler(address + index, byte)
+            address += count
+            offset += count
+
+    def transfer(self, *, source: int, destination: int, size: int):
+        # block copies like oam dma, a mapped source page is handed to the writer as a view without a copy
+        end = source + size
+        while source < end:
+            page = self._read_pages[source >> 8]
+            count = min(end, (source | 0xFF) + 1) - source
+            if page is None:
+                chunk = self.read(address=source, size=count)
+            else:
+                chunk = page[source & 0xFF:(source & 0xFF) + count]
+            self.write(address=destination, value=chunk)
+            source += count
+            destination += count
@@ -1,7 +1,209 @@
+import mmap
+import os
+import struct
+from typing import Dict, Optional, Set, Type
+
+
+class MBC:
+    # no banking hardware, writes to the rom area are ignored
+
+    state_struct = struct.Struct('<3H?')
+
+    def __init__(self, *, bank_count: int):
+        self.bank_count = bank_count
+        self.rom_bank_0 = 0
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.ram_enabled = False
+
+    def _select(self, bank: int) -> int:
+        return bank % self.bank_count
+
+    def get_state(self) -> tuple:
+        return self.rom_bank_0, self.rom_bank, self.ram_bank, self.ram_enabled
+
+    def set_state(self, state: tuple):
+        self.rom_bank_0, self.rom_bank, self.ram_bank, self.ram_enabled = state
+
+    def write8(self, address: int, value: int):
+        pass
+
+
+class MBC1(MBC):
+
+    state_struct = struct.Struct('<3H?3B')
+
+    def __init__(self, *, bank_count: int):
+        super().__init__(bank_count=bank_count)
+        self._low_bits = 1
+        self._high_bits = 0
+        self._mode = 0
+
+    def get_state(self) -> tuple:
+        return super().get_state() + (self._low_bits, self._high_bits, self._mode)
+
+    def set_state(self, state: tuple):
+        super().set_state(state[:4])
+        self._low_bits, self._high_bits, self._mode = state[4:]
+
+    def _update(self):
+        self.rom_bank = self._select((self._high_bits << 5) | self._low_bits)
+        # in mode 1 the upper bits also move the lower area and pick the ram bank
+        self.rom_bank_0 = self._select(self._high_bits << 5) if self._mode else 0
+        self.ram_bank = self._high_bits if self._mode else 0
+
+    def write8(self, address: int, value: int):
+        if address < 0x2000:
+            self.ram_enabled = (value & 0x0F) == 0x0A
+        elif address < 0x4000:
+            self._low_bits = (value & 0x1F) or 1
+        elif address < 0x6000:
+            self._high_bits = value & 0x03
+        else:
+            self._mode = value & 0x01
+        self._update()
+
+
+class MBC3(MBC):
+
+    def write8(self, address: int, value: int):
+        if address < 0x2000:
+            self.ram_enabled = (value & 0x0F) == 0x0A
+        elif address < 0x4000:
+            self.rom_bank = self._select((value & 0x7F) or 1)
+        elif address < 0x6000:
+            # 0x08-0x0C select the clock registers, which are not emulated
+            if value < 0x08:
+                self.ram_bank = value & 0x03
+
+
+class MBC5(MBC):
+
+    def write8(self, address: int, value: int):
+        if address < 0x2000:
+            self.ram_enabled = (value & 0x0F) == 0x0A
+        elif address < 0x3000:
+            self.rom_bank = self._select((self.rom_bank & 0x100) | value)
+        elif address < 0x4000:
+            self.rom_bank = self._select(((value & 0x01) << 8) | (self.rom_bank & 0xFF))
+        elif address < 0x6000:
+            self.ram_bank = value & 0x0F
+
+
+class CartRAM:
+
+    PAGE_SIZE = 0x100
+    BANK_SIZE = 0x2000
+
+    def __init__(self, *, size: int, path: str=None):
+        self.size = size
+        self._mmap: Optional[mmap.mmap] = None
+        if path is None:
+            self._memory = bytearray([0] * size)
+        else:
+            # battery backed, the save file is the memory and the os pages it out
+            with open(path, "a+b") as save_file:
+                if os.path.getsize(path) < size:
+                    save_file.truncate(size)
+                self._mmap = mmap.mmap(save_file.fileno(), size, access=mmap.ACCESS_WRITE)
+            self._memory = self._mmap
+        self._dirty_pages: Set[int] = set()
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._memory)
+
+    @property
+    def bank_count(self) -> int:
+        return max(1, self.size // self.BANK_SIZE)
+
+    def bank(self, number: int) -> memoryview:
+        start = (number % self.bank_count) * self.BANK_SIZE
+        return self.memory[start: start + min(self.size, self.BANK_SIZE)]
+
+    def write8(self, address: int, value: int):
+        self._memory[address] = value
+        self._dirty_pages.add(address >> 8)
+
+    def mark_dirty(self):
+        # after the whole memory was replaced at once
+        self._dirty_pages.update(range((self.size + self.PAGE_SIZE - 1) // self.PAGE_SIZE))
+
+    def flush(self):
+        if self._mmap is None or not self._dirty_pages:
+            return
+        # msync works on whole os pages, so flush each one holding a dirty page once
+        for start in sorted({(page * self.PAGE_SIZE) // mmap.PAGESIZE * mmap.PAGESIZE for page in self._dirty_pages}):
+            self._mmap.flush(start, min(mmap.PAGESIZE, self.size - start))
+        self._dirty_pages.clear()
+
+
 class Cart:
 
+    BANK_SIZE = 0x4000
+    CART_TYPE = 0x0147
+    RAM_SIZE = 0x0149
+
+    RAM_SIZES = {0x00: 0, 0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}
+    BATTERY_TYPES = {0x03, 0x0F, 0x10, 0x13, 0x1B, 0x1E}
+
+    MBC_TYPES: Dict[int, Type[MBC]] = {
+        0x00: MBC,
+        0x01: MBC1, 0x02: MBC1, 0x03: MBC1,
+        0x0F: MBC3, 0x10: MBC3, 0x11: MBC3, 0x12: MBC3, 0x13: MBC3,
+        0x19: MBC5, 0x1A: MBC5, 0x1B: MBC5, 0x1C: MBC5, 0x1D: MBC5, 0x1E: MBC5,
+    }
+
     def __init__(self):
-        self._content: bytearray = bytearray()
+        self._content = bytearray([0] * (2 * self.BANK_SIZE))
+        self._mbc = MBC(bank_count=2)
+        self._ram: Optional[CartRAM] = None
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._content)
+
+    @property
+    def rom_bank(self) -> int:
+        return self._mbc.rom_bank
+
+    @property
+    def rom_bank_0(self) -> int:
+        return self._mbc.rom_bank_0
+
+    @property
+    def mbc(self) -> MBC:
+        return self._mbc
+
+    @property
+    def ram(self) -> Optional[CartRAM]:
+        return self._ram
+
+    def load(self, *, path: str):
+        with open(path, "rb") as rom_file:
+            # mapped rather than read, so only the banks that are used get paged in
+            content = mmap.mmap(rom_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(content) < 2 * self.BANK_SIZE:
+            content = bytearray(content[:]).ljust(2 * self.BANK_SIZE, b'\x00')
+        cart_type = content[self.CART_TYPE]
+        if cart_type not in self.MBC_TYPES:
+            raise Exception(f'Cartridge type 0x{cart_type:02X} is not supported')
+        self._content = content
+        self._mbc = self.MBC_TYPES[cart_type](bank_count=len(content) // self.BANK_SIZE)
+        ram_size = self.RAM_SIZES.get(content[self.RAM_SIZE], 0)
+        if ram_size:
+            save_path = os.path.splitext(path)[0] + '.sav' if cart_type in self.BATTERY_TYPES else None
+            self._ram = CartRAM(size=ram_size, path=save_path)
+
+    def bank(self, number: int) -> memoryview:
+        return self.memory[number * self.BANK_SIZE: (number + 1) * self.BANK_SIZE]
 
     def read(self, *, address: int, size: int=1):
         return self._content[address: address+size]
+
+    def write8(self, address: int, value: int):
+        self._mbc.write8(address, value)
+
+    def flush(self):
+        if self._ram is not None:
+            self._ram.flush()
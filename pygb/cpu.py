@@ -1,14 +1,33 @@
-from pygb.instructions import Instruction
+import struct
+import time
+from functools import partial
+from pygb.flags import AluFlags
+from pygb.idle import IdleLoopDetector
+from pygb.instructions import CB_PREFIX, OPCODES
+from pygb.profiler import CB_KEY, Profiler
+from pygb.recompiler import Recompiler
+from pygb.trace import Tracer
 from pygb.utils import is_bit_set, set_bit
-from typing import TYPE_CHECKING
+from typing import Callable, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
+    from pygb.interrupts import Interrupts
     from pygb.motherboard import Motherboard
 
 
 class CPU:
 
-    def __init__(self, *, motherboard: "Motherboard"):
+    # a, b, c, d, e, f, h, l, pc, sp and whether it is halted
+    state_struct = struct.Struct('<8B2H?')
+
+    # cycles spent pushing pc and jumping to a vector
+    INTERRUPT_CYCLES = 20
+
+    def __init__(self, *, motherboard: "Motherboard", lazy_flags: bool=True, recompile: bool=False,
+                 tracer: Tracer=None, idle_skip: bool=True):
         self._motherboard = motherboard
+        self._bus = motherboard.bus
+        self._interrupts = motherboard.interrupts
+        self._opcodes = OPCODES
         self._reg_a = 0x00
         self._reg_b = 0x00
         self._reg_c = 0x00
@@ -19,6 +38,26 @@ class CPU:
         self._reg_l = 0x00
         self._reg_pc = 0x0000
         self._reg_sp = 0x0000
+        # set by halt, which runs again after every event until an interrupt is pending
+        self.halted = False
+        # last alu operation whose flags have not been folded into reg_f yet
+        self._flags_op: AluFlags = None
+        self._flags_operand = 0x00
+        self._flags_result = 0x00
+        self.set_alu_flags = self._defer_alu_flags if lazy_flags else self._apply_alu_flags
+        self._recompiler = Recompiler(bus=self._bus) if recompile else None
+        self._tracer = tracer
+        self._profiler: Profiler = None
+        self._idle_loops = IdleLoopDetector(bus=self._bus, io=motherboard.io)
+        # end of the last backward jump taken, the cycle it completed on and the deadline it saw
+        self._last_loop: Tuple[int, int, float] = (-1, -1, -1)
+        # called by every backward jump taken, with the cycles the instruction or block spent so far
+        self.loop_back = self._skip_idle_loop if idle_skip and tracer is None else self._ignore_loop
+        if recompile:
+            self.tick = self._tick_block
+        if tracer is not None:
+            # tracing needs every instruction, so it always takes the interpreter
+            self.tick = self._tick_traced
 
     @property
     def reg_a(self):
@@ -54,7 +93,7 @@ class CPU:
 
     @property
     def reg_e(self):
-        return self._reg_a
+        return self._reg_e
 
     @reg_e.setter
     def reg_e(self, value):
@@ -62,10 +101,13 @@ class CPU:
 
     @property
     def reg_f(self):
+        if self._flags_op is not None:
+            self._resolve_flags()
         return self._reg_f
 
     @reg_f.setter
     def reg_f(self, value):
+        self._flags_op = None
         self._reg_f = value & 0xFF
 
     @property
@@ -136,11 +178,43 @@ class CPU:
         self.reg_h = (val >> 8)
         self.reg_l = (val & 0xFF)
 
+    @property
+    def interrupts(self) -> "Interrupts":
+        return self._interrupts
+
+    def get_state(self) -> tuple:
+        return (self._reg_a, self._reg_b, self._reg_c, self._reg_d, self._reg_e, self.reg_f, self._reg_h,
+                self._reg_l, self._reg_pc, self._reg_sp, self.halted)
+
+    def set_state(self, state: tuple):
+        (self._reg_a, self._reg_b, self._reg_c, self._reg_d, self._reg_e, self._reg_f, self._reg_h,
+         self._reg_l, self._reg_pc, self._reg_sp, self.halted) = state
+        self._flags_op = None
+        self._last_loop = (-1, -1, -1)
+        if self._recompiler is not None:
+            # memory is about to be replaced wholesale, blocks built from it cannot be trusted
+            self._recompiler.clear()
+
     @staticmethod
     def unset_bit(source: int, bit_no: int):
         source &= ~(0x1 << bit_no)
         return source
 
+    def _resolve_flags(self):
+        op = self._flags_op
+        self._flags_op = None
+        self._reg_f = (self._reg_f & op.keep) | op.compute(self._flags_operand, self._flags_result)
+
+    def _apply_alu_flags(self, op: AluFlags, operand: int, result: int):
+        self._reg_f = (self.reg_f & op.keep) | op.compute(operand, result)
+
+    def _defer_alu_flags(self, op: AluFlags, operand: int, result: int):
+        if op.keep and self._flags_op is not None:
+            self._resolve_flags()
+        self._flags_op = op
+        self._flags_operand = operand
+        self._flags_result = result
+
     @property
     def flag_z(self):
         return is_bit_set(self.reg_f, 7)
@@ -179,20 +253,135 @@ class CPU:
     def write(self, *, address: int, value: bytes):
         self._motherboard.write(address=address, value=value)
 
+    def read8(self, address: int) -> int:
+        return self._bus.read8(address)
+
+    def write8(self, address: int, value: int):
+        self._bus.write8(address, value)
+
+    def peek8(self, address: int) -> int:
+        return self._bus.peek8(address)
+
+    def push16(self, value: int):
+        self._reg_sp = (self._reg_sp - 1) & 0xFFFF
+        self._bus.write8(self._reg_sp, value >> 8)
+        self._reg_sp = (self._reg_sp - 1) & 0xFFFF
+        self._bus.write8(self._reg_sp, value & 0xFF)
+
+    def pop16(self) -> int:
+        lsb = self._bus.read8(self._reg_sp)
+        msb = self._bus.read8((self._reg_sp + 1) & 0xFFFF)
+        self._reg_sp = (self._reg_sp + 2) & 0xFFFF
+        return (msb << 8) | lsb
+
     def fetch_next(self) -> int:
-        opcode = self.read(address=self.reg_pc, size=1)[0]
-        self.reg_pc += 1
+        opcode = self._bus.read8(self._reg_pc)
+        self._reg_pc = (self._reg_pc + 1) & 0xFFFF
         return opcode
 
-    def _fetch_instruction(self) -> Instruction:
-        opcode = self.fetch_next()
-        return Instruction.get_instruction(opcode)
-
     def tick(self):
-        instruction: Instruction = self._fetch_instruction()
-        instruction.init(self)
-        instruction.execute(self)
-        instruction.set_flags(self)
-        self._motherboard.tick(cycles=instruction.cycles)
-        print(f'{instruction.name}: A={self.reg_a:02X} B={self.reg_b:02X} C={self.reg_c:02X} HL={self.reg_hl:04X} SP={self.reg_sp:04X}, PC={self.reg_pc:04X}, cycles={self._motherboard._ticks}, flags={self.reg_f:08b}')
+        if self._interrupts.ready:
+            cycles = self._dispatch_interrupt()
+        else:
+            opcode = self.fetch_next()
+            cycles = self._opcodes[opcode](self)
+        self._motherboard.tick(cycles=cycles)
+
+    def execute_next(self) -> int:
+        # one instruction without the interrupt check or ticking, for instructions that take effect after the next
+        return self._opcodes[self.fetch_next()](self)
+
+    def _dispatch_interrupt(self) -> int:
+        # a halted cpu sits on its halt, it returns to the instruction after it
+        if self.halted:
+            self.halted = False
+            self._reg_pc = (self._reg_pc + 1) & 0xFFFF
+        self.push16(self._reg_pc)
+        self._reg_pc = self._interrupts.acknowledge()
+        return self.INTERRUPT_CYCLES
+
+    def sleep_cycles(self) -> int:
+        # a halted cpu has nothing to do before the next event, which is the only thing that can raise an interrupt
+        scheduler = self._motherboard.scheduler
+        if scheduler.deadline == scheduler.IDLE:
+            raise Exception('HALT with no event scheduled that could wake it')
+        return max(4, (scheduler.deadline - self._motherboard.ticks + 3) & ~3)
 
+    @property
+    def step(self) -> Callable[[], None]:
+        # one instruction at a time, a recompiled block could run past an address the caller waits for
+        return partial(CPU.tick, self) if self.tick == self._tick_block else self.tick
+
+    def _tick_block(self):
+        # runs a whole recompiled block, or one interpreted instruction where none could be built
+        if self._interrupts.ready:
+            return CPU.tick(self)
+        block = self._recompiler.get_block(self._reg_pc)
+        if block is None:
+            return CPU.tick(self)
+        cycles = block(self)
+        self._motherboard.tick(cycles=cycles)
+
+    def _tick_traced(self):
+        self._tracer.record(self)
+        CPU.tick(self)
+
+    def _ignore_loop(self, target: int, end: int, elapsed: int):
+        pass
+
+    def _skip_idle_loop(self, target: int, end: int, elapsed: int):
+        # a loop that only polls registers the scheduler drives ends each pass exactly as it started,
+        # so once a whole pass has run, every pass up to the next event can be counted instead of run
+        # an event in the middle of the pass may have changed what it polled, which the deadline moving shows
+        scheduler = self._motherboard.scheduler
+        now, deadline = self._motherboard.ticks + elapsed, scheduler.deadline
+        last_end, last_now, last_deadline = self._last_loop
+        self._last_loop = (end, now, deadline)
+        if last_end != end or last_deadline != deadline or deadline == scheduler.IDLE:
+            return
+        cycles = self._idle_loops.loop_cycles(target, end)
+        if not cycles or now - last_now != cycles:
+            return
+        # stays short of the event, it fires after this jump completes just as it would have
+        skipped = (deadline - now) // cycles * cycles
+        if skipped > 0:
+            self._motherboard.tick(cycles=skipped)
+            self._last_loop = (end, now + skipped, deadline)
+
+    @property
+    def profiler(self) -> Profiler:
+        return self._profiler
+
+    def start_profiling(self, *, profiler: Profiler=None) -> Profiler:
+        # profiling swaps in its own dispatch and bus, so nothing is counted or checked while it is off
+        if self._profiler is not None:
+            return self._profiler
+        self._profiler = profiler if profiler is not None else Profiler()
+        self._unprofiled = (self.tick, self._bus)
+        self._bus = self._profiler.counting_bus(self._bus)
+        # it replaces tracing and recompiled blocks while it runs, every instruction goes through it
+        self.tick = self._tick_profiled
+        return self._profiler
+
+    def stop_profiling(self) -> Profiler:
+        profiler = self._profiler
+        if profiler is not None:
+            self.tick, self._bus = self._unprofiled
+            self._profiler = None
+        return profiler
+
+    def _tick_profiled(self):
+        if self._interrupts.ready:
+            return CPU.tick(self)
+        profiler = self._profiler
+        pc = self._reg_pc
+        opcode = self.fetch_next()
+        # cb opcodes are told apart by the byte following the prefix
+        key = opcode if opcode != CB_PREFIX.opcode else CB_KEY | self._bus.peek8(self._reg_pc)
+        if profiler.count(self._bus.code_bank(pc), pc, key):
+            start = time.perf_counter_ns()
+            cycles = self._opcodes[opcode](self)
+            profiler.sample(key, time.perf_counter_ns() - start)
+        else:
+            cycles = self._opcodes[opcode](self)
+        self._motherboard.tick(cycles=cycles)
@@ -0,0 +1,51 @@
+from abc import abstractmethod
+
+Z_FLAG = 0x80
+N_FLAG = 0x40
+H_FLAG = 0x20
+C_FLAG = 0x10
+
+
+class AluFlags:
+    # flag bits the operation leaves as they were
+    keep = 0x00
+    # whether z is set exactly when the result is zero
+    z_from_result = True
+
+    @staticmethod
+    @abstractmethod
+    def compute(operand: int, result: int) -> int:
+        pass
+
+
+class IncFlags(AluFlags):
+    keep = C_FLAG
+
+    @staticmethod
+    def compute(operand: int, result: int) -> int:
+        return (Z_FLAG if result == 0 else 0) | (H_FLAG if (result & 0x0F) == 0 else 0)
+
+
+class XorFlags(AluFlags):
+
+    @staticmethod
+    def compute(operand: int, result: int) -> int:
+        return Z_FLAG if result == 0 else 0
+
+
+class BitFlags(AluFlags):
+    keep = C_FLAG
+
+    @staticmethod
+    def compute(operand: int, result: int) -> int:
+        return (Z_FLAG if result == 0 else 0) | H_FLAG
+
+
+class CpFlags(AluFlags):
+
+    @staticmethod
+    def compute(operand: int, result: int) -> int:
+        # the result is a - operand masked to a byte, which gives a back
+        value = (result + operand) & 0xFF
+        return (Z_FLAG if result == 0 else 0) | N_FLAG | (H_FLAG if (operand & 0x0F) > (value & 0x0F) else 0) | \
+            (C_FLAG if operand > value else 0)
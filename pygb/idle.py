@@ -0,0 +1,52 @@
+from pygb.instructions import CB_PREFIX, Instruction, JR_NZ_R8, LDH_A_A8_ADDR
+from typing import Dict, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.bus import Bus
+    from pygb.io import IO
+
+
+class IdleLoopDetector:
+
+    # instructions a loop may hold besides the jump closing it
+    MAX_LENGTH = 16
+
+    def __init__(self, *, bus: "Bus", io: "IO"):
+        self._bus = bus
+        self._io = io
+        # cycles of one pass through every loop seen so far, 0 for those that do something
+        self._loops: Dict[Tuple[int, int, int], int] = {}
+
+    def loop_cycles(self, target: int, end: int) -> int:
+        # end is the address after the jump back to target
+        key = (self._bus.code_bank(target), target, end)
+        try:
+            return self._loops[key]
+        except KeyError:
+            cycles = self._loops[key] = self._decode(target, end)
+            return cycles
+
+    def _decode(self, target: int, end: int) -> int:
+        # only rom, code in ram could be rewritten while the loop is skipped
+        if end > 0x8000:
+            return 0
+        pc, cycles, jump = target, 0, end - JR_NZ_R8.length
+        for _ in range(self.MAX_LENGTH):
+            if pc == jump:
+                break
+            opcode = self._bus.peek8(pc)
+            instruction = Instruction.instructions.get(opcode)
+            if opcode == CB_PREFIX.opcode:
+                instruction = CB_PREFIX.instructions.get(self._bus.peek8(pc + 1))
+            if instruction is None or instruction.idle_role is None:
+                return 0
+            if isinstance(instruction, LDH_A_A8_ADDR):
+                address = instruction.polled_address(self._bus.peek8(pc + 1))
+                if self._io.is_clocked(address - 0xFF00):
+                    return 0
+            pc += CB_PREFIX.length if opcode == CB_PREFIX.opcode else instruction.length
+            cycles += instruction.cycles
+        else:
+            return 0
+        if pc != jump or self._bus.peek8(pc) != JR_NZ_R8.opcode:
+            return 0
+        return cycles + 12
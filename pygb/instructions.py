@@ -1,8 +1,8 @@
-from abc import abstractmethod
-from pygb.utils import is_bit_set
-from typing import ClassVar, TYPE_CHECKING
+from pygb.flags import BitFlags, CpFlags, IncFlags, XorFlags
+from typing import Callable, ClassVar, List, Optional, TYPE_CHECKING
 if TYPE_CHECKING:
     from pygb.cpu import CPU
+    from pygb.recompiler import BlockBuilder
 
 
 class Instruction:
@@ -10,10 +10,10 @@ class Instruction:
     opcode = 0
     instructions = {}
     cycles = 4
-    z_flag = None
-    n_flag = None
-    h_flag = None
-    c_flag = None
+    length = 1
+    # how the instruction can take part in an idle loop: 'poll' loads a from memory,
+    # 'test' changes nothing but flags, or changes a in a way repeating it leaves alone
+    idle_role: Optional[str] = None
 
     @classmethod
     def register(cls, val: ClassVar["Instruction"]):
@@ -26,34 +26,19 @@ class Instruction:
             raise Exception('No instruction with opcode 0x{:02X} is found'.format(opcode))
         return inst
 
-    def init(self, cpu: "CPU"):
-        pass
-
-    @abstractmethod
-    def execute(self, cpu: "CPU"):
-        pass
-
-    def set_z_flag(self, cpu: "CPU"):
-        if self.z_flag:
-            cpu.flag_z = self.z_flag
-
-    def set_n_flag(self, cpu: "CPU"):
-        if self.n_flag:
-            cpu.flag_n = self.n_flag
-
-    def set_h_flag(self, cpu: "CPU"):
-        if self.h_flag:
-            cpu.flag_h = self.h_flag
+    @classmethod
+    def build_table(cls) -> List[Callable[["CPU"], int]]:
+        # unregistered opcodes fall back to the lookup so they raise the usual error
+        table = [lambda cpu, opcode=opcode: cls.get_instruction(opcode).execute(cpu) for opcode in range(0x100)]
+        for opcode, instruction in cls.instructions.items():
+            table[opcode] = instruction.execute
+        return table
 
-    def set_c_flag(self, cpu: "CPU"):
-        if self.c_flag:
-            cpu.flag_c = self.c_flag
+    def execute(self, cpu: "CPU") -> int:
+        return self.cycles
 
-    def set_flags(self, cpu: "CPU"):
-        self.set_z_flag(cpu)
-        self.set_n_flag(cpu)
-        self.set_h_flag(cpu)
-        self.set_c_flag(cpu)
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        return None
 
 
 class NO_OP(Instruction):
@@ -61,6 +46,10 @@ class NO_OP(Instruction):
     name = 'NOP'
     opcode = 0x00
     cycles = 4
+    idle_role = 'test'
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        return self.cycles
 
 
 Instruction.register(NO_OP)
@@ -70,11 +59,17 @@ class LD_BC_D16(Instruction):
     name = 'LD_BC_D16'
     opcode = 0x01
     cycles = 12
+    length = 3
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         lsb: int = cpu.fetch_next()
         msb: int = cpu.fetch_next()
         cpu.reg_bc = (msb << 8) + lsb
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg16('bc', str(block.fetch16()))
+        return self.cycles
 
 
 Instruction.register(LD_BC_D16)
@@ -85,8 +80,14 @@ class LD_BC_ADDR_A(Instruction):
     opcode = 0x02
     cycles = 8
 
-    def execute(self, cpu: "CPU"):
-        cpu.write(address=cpu.reg_bc, value=cpu.reg_a.to_bytes(1, "big"))
+    def execute(self, cpu: "CPU") -> int:
+        cpu.write8(cpu.reg_bc, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        if not block.write8(block.reg16('bc'), block.reg('a')):
+            return None
+        return self.cycles
 
 
 Instruction.register(LD_BC_ADDR_A)
@@ -96,12 +97,18 @@ class INC_C(Instruction):
     name = 'INC_C'
     opcode = 0x0C
     cycles = 4
-    n_flag = 0
 
-    def execute(self, cpu: "CPU"):
-        cpu.reg_c += 1
-        self.z_flag = int(cpu.reg_c == 0)
-        self.h_flag = int((cpu.reg_c & 0xFF) == 0)
+    def execute(self, cpu: "CPU") -> int:
+        operand = cpu.reg_c
+        cpu.reg_c = operand + 1
+        cpu.set_alu_flags(IncFlags, operand, cpu.reg_c)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        operand = block.temp(block.reg('c'))
+        block.set_reg('c', f'{operand} + 1')
+        block.alu_flags(IncFlags, operand, block.reg('c'))
+        return self.cycles
 
 
 Instruction.register(INC_C)
@@ -111,9 +118,15 @@ class LD_C_D8(Instruction):
     name = 'LD_C_D8'
     opcode = 0x0E
     cycles = 8
+    length = 2
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         cpu.reg_c = cpu.fetch_next()
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg('c', str(block.fetch8()))
+        return self.cycles
 
 
 Instruction.register(LD_C_D8)
@@ -123,11 +136,17 @@ class LD_DE_D16(Instruction):
     name = 'LD_DE_D16'
     opcode = 0x11
     cycles = 12
+    length = 3
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         lsb: int = cpu.fetch_next()
         msb: int = cpu.fetch_next()
         cpu.reg_de = (msb << 8) + lsb
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg16('de', str(block.fetch16()))
+        return self.cycles
 
 
 Instruction.register(LD_DE_D16)
@@ -138,8 +157,14 @@ class LD_DE_ADDR_A(Instruction):
     opcode = 0x12
     cycles = 8
 
-    def execute(self, cpu: "CPU"):
-        cpu.write(address=cpu.reg_de, value=cpu.reg_a.to_bytes(1, "big"))
+    def execute(self, cpu: "CPU") -> int:
+        cpu.write8(cpu.reg_de, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        if not block.write8(block.reg16('de'), block.reg('a')):
+            return None
+        return self.cycles
 
 
 Instruction.register(LD_DE_ADDR_A)
@@ -149,12 +174,18 @@ class INC_E(Instruction):
     name = 'INC_E'
     opcode = 0x1C
     cycles = 4
-    n_flag = 0
 
-    def execute(self, cpu: "CPU"):
-        cpu.reg_e += 1
-        self.z_flag = int(cpu.reg_e == 0)
-        self.h_flag = int((cpu.reg_e & 0xFF) == 0)
+    def execute(self, cpu: "CPU") -> int:
+        operand = cpu.reg_e
+        cpu.reg_e = operand + 1
+        cpu.set_alu_flags(IncFlags, operand, cpu.reg_e)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        operand = block.temp(block.reg('e'))
+        block.set_reg('e', f'{operand} + 1')
+        block.alu_flags(IncFlags, operand, block.reg('e'))
+        return self.cycles
 
 
 Instruction.register(INC_E)
@@ -164,9 +195,15 @@ class LD_E_D8(Instruction):
     name = 'LD_E_D8'
     opcode = 0x1E
     cycles = 8
+    length = 2
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         cpu.reg_e = cpu.fetch_next()
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg('e', str(block.fetch8()))
+        return self.cycles
 
 
 Instruction.register(LD_E_D8)
@@ -175,21 +212,28 @@ Instruction.register(LD_E_D8)
 class JR_NZ_R8(Instruction):
     name = 'JR_NZ_R8'
     opcode = 0x20
+    cycles = 8
+    length = 2
 
-    def __init__(self):
-        self._cycles = 8
-
-    @property
-    def cycles(self):
-        return self._cycles
-
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         offset = cpu.fetch_next()
         if not cpu.flag_z:
-            cpu.reg_pc += offset
-            self._cycles = 12
-        else:
-            self._cycles = 8
+            if offset & 0x80:
+                end = cpu.reg_pc
+                cpu.reg_pc += offset - 0x100
+                # a backward jump may close a loop that only waits for something to happen
+                cpu.loop_back(cpu.reg_pc, end, 12)
+            else:
+                cpu.reg_pc += offset
+            return 12
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        offset = block.fetch8()
+        target = (block.pc + (offset - 0x100 if offset & 0x80 else offset)) & 0xFFFF
+        block.branch(condition=block.not_zero(), target=target, extra_cycles=12 - self.cycles,
+                     loop=bool(offset & 0x80))
+        return self.cycles
 
 
 Instruction.register(JR_NZ_R8)
@@ -199,11 +243,17 @@ class LD_HL_D16(Instruction):
     name = 'LD_HL_D16'
     opcode = 0x21
     cycles = 12
+    length = 3
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         lsb: int = cpu.fetch_next()
         msb: int = cpu.fetch_next()
         cpu.reg_hl = (msb << 8) + lsb
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg16('hl', str(block.fetch16()))
+        return self.cycles
 
 
 Instruction.register(LD_HL_D16)
@@ -213,9 +263,15 @@ class LD_L_D8(Instruction):
     name = 'LD_C_D8'
     opcode = 0x2E
     cycles = 8
+    length = 2
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         cpu.reg_l = cpu.fetch_next()
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg('l', str(block.fetch8()))
+        return self.cycles
 
 
 Instruction.register(LD_L_D8)
@@ -225,11 +281,17 @@ class LD_SP_D16(Instruction):
     name = 'LD_SP_D16'
     opcode = 0x31
     cycles = 12
+    length = 3
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         lsb: int = cpu.fetch_next()
         msb: int = cpu.fetch_next()
         cpu.reg_sp = (msb << 8) + lsb
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg16('sp', str(block.fetch16()))
+        return self.cycles
 
 
 Instruction.register(LD_SP_D16)
@@ -240,9 +302,17 @@ class LD_HL_DEC_A(Instruction):
     opcode = 0x32
     cycles = 8
 
-    def execute(self, cpu: "CPU"):
-        cpu.write(address=cpu.reg_hl, value=cpu.reg_a.to_bytes(1, 'big'))
+    def execute(self, cpu: "CPU") -> int:
+        cpu.write8(cpu.reg_hl, cpu.reg_a)
         cpu.reg_hl -= 1
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        address = block.temp(block.reg16('hl'))
+        if not block.write8(address, block.reg('a')):
+            return None
+        block.set_reg16('hl', f'{address} - 1')
+        return self.cycles
 
 
 Instruction.register(LD_HL_DEC_A)
@@ -252,9 +322,15 @@ class LD_A_D8(Instruction):
     name = 'LD_A_D8'
     opcode = 0x3E
     cycles = 8
+    length = 2
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         cpu.reg_a = cpu.fetch_next()
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        block.set_reg('a', str(block.fetch8()))
+        return self.cycles
 
 
 Instruction.register(LD_A_D8)
@@ -265,59 +341,89 @@ class LD_HL_ADDR_A(Instruction):
     opcode = 0x77
     cycles = 8
 
-    def execute(self, cpu: "CPU"):
-        cpu.write(address=cpu.reg_hl, value=cpu.reg_a.to_bytes(1, 'big'))
+    def execute(self, cpu: "CPU") -> int:
+        cpu.write8(cpu.reg_hl, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        if not block.write8(block.reg16('hl'), block.reg('a')):
+            return None
+        return self.cycles
 
 
 Instruction.register(LD_HL_ADDR_A)
 
 
+class HALT(Instruction):
+    name = 'HALT'
+    opcode = 0x76
+
+    def execute(self, cpu: "CPU") -> int:
+        if cpu.interrupts.pending:
+            cpu.halted = False
+            return self.cycles
+        # stays on the halt and sleeps through to the next event, then looks again
+        cpu.halted = True
+        cpu.reg_pc -= 1
+        return cpu.sleep_cycles()
+
+
+Instruction.register(HALT)
+
+
 class XOR_A(Instruction):
     name = 'XOR_A'
     opcode = 0xAF
     cycles = 4
-    n_flag = 0
-    h_flag = 0
-    c_flag = 0
+    idle_role = 'test'
 
-    def execute(self, cpu: "CPU"):
-        cpu.reg_a ^= cpu.reg_a
-        self.z_flag = int(cpu.reg_a == 0)
+    def execute(self, cpu: "CPU") -> int:
+        operand = cpu.reg_a
+        cpu.reg_a = operand ^ operand
+        cpu.set_alu_flags(XorFlags, operand, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        operand = block.reg('a')
+        block.set_reg('a', '0')
+        block.alu_flags(XorFlags, operand, block.reg('a'))
+        return self.cycles
 
 
 Instruction.register(XOR_A)
 
 
 class CB_PREFIX(Instruction):
+    name = 'PREFIX_CB'
     instructions = {}
     opcode = 0xCB
+    length = 2
 
-    @property
-    def name(self):
-        return self.instruction.name
-
-    @property
-    def cycles(self):
-        return self.instruction.cycles
+    def execute(self, cpu: "CPU") -> int:
+        return CB_OPCODES[cpu.fetch_next()](cpu)
 
-    def __init__(self):
-        self.instruction: Instruction = None
-
-    def init(self, cpu: "CPU"):
-        sub_opcode = cpu.fetch_next()
-        self.instruction = CB_PREFIX.get_instruction(sub_opcode)
-
-    def execute(self, cpu: "CPU"):
-        return self.instruction.execute(cpu)
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        instruction = CB_PREFIX.instructions.get(block.fetch8())
+        if instruction is None:
+            return None
+        return instruction.translate(block)
 
 
 class BIT_7H(Instruction):
     name = 'BIT_7H'
     opcode = 0x7C
     cycles = 8
+    idle_role = 'test'
 
-    def execute(self, cpu: "CPU"):
-        self.z_flag = 1 if is_bit_set(cpu.reg_h, 7) else 0
+    def execute(self, cpu: "CPU") -> int:
+        operand = cpu.reg_h
+        cpu.set_alu_flags(BitFlags, operand, operand & 0x80)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        operand = block.reg('h')
+        block.alu_flags(BitFlags, operand, block.temp(f'{operand} & 0x80'))
+        return self.cycles
 
 
 CB_PREFIX.register(BIT_7H)
@@ -326,14 +432,35 @@ CB_PREFIX.register(BIT_7H)
 Instruction.register(CB_PREFIX)
 
 
+class RETI(Instruction):
+    name = 'RETI'
+    opcode = 0xD9
+    cycles = 16
+
+    def execute(self, cpu: "CPU") -> int:
+        cpu.reg_pc = cpu.pop16()
+        cpu.interrupts.ime = True
+        return self.cycles
+
+
+Instruction.register(RETI)
+
+
 class LDH_A8_ADDR_A(Instruction):
     name = 'LDH_(a8)_A'
     opcode = 0xE0
     cycles = 12
+    length = 2
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         address = 0xFF00 + cpu.fetch_next()
-        cpu.write(address=address, value=cpu.reg_a.to_bytes(1, "big"))
+        cpu.write8(address, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        if not block.write8(f'0x{0xFF00 + block.fetch8():04X}', block.reg('a')):
+            return None
+        return self.cycles
 
 
 Instruction.register(LDH_A8_ADDR_A)
@@ -344,9 +471,97 @@ class LD_C_ADDR_A(Instruction):
     opcode = 0xE2
     cycles = 8
 
-    def execute(self, cpu: "CPU"):
+    def execute(self, cpu: "CPU") -> int:
         address = 0xFF00 + cpu.reg_c
-        cpu.write(address=address, value=cpu.reg_a.to_bytes(1, "big"))
+        cpu.write8(address, cpu.reg_a)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        # always the io page, which only the first instruction of a block may touch
+        if block.size:
+            return None
+        block.write8(f'0xFF00 + {block.reg("c")}', block.reg('a'))
+        block.stop()
+        return self.cycles
+
+
+Instruction.register(LD_C_ADDR_A)
+
+
+class LDH_A_A8_ADDR(Instruction):
+    name = 'LDH_A_(a8)'
+    opcode = 0xF0
+    cycles = 12
+    length = 2
+    idle_role = 'poll'
+
+    @staticmethod
+    def polled_address(operand: int) -> int:
+        return 0xFF00 + operand
+
+    def execute(self, cpu: "CPU") -> int:
+        cpu.reg_a = cpu.read8(0xFF00 + cpu.fetch_next())
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        address = f'0x{0xFF00 + block.fetch8():04X}'
+        if not block.io_access(address):
+            return None
+        block.set_reg('a', f'read8({address})')
+        return self.cycles
+
+
+Instruction.register(LDH_A_A8_ADDR)
+
+
+class DI(Instruction):
+    name = 'DI'
+    opcode = 0xF3
+
+    def execute(self, cpu: "CPU") -> int:
+        cpu.interrupts.ime = False
+        return self.cycles
+
+
+Instruction.register(DI)
+
+
+class EI(Instruction):
+    name = 'EI'
+    opcode = 0xFB
+
+    def execute(self, cpu: "CPU") -> int:
+        # ime is only set once the next instruction has run, unless that one turned it off again
+        opcode = cpu.peek8(cpu.reg_pc)
+        cycles = self.cycles + cpu.execute_next()
+        if opcode != DI.opcode:
+            cpu.interrupts.ime = True
+        return cycles
+
+
+Instruction.register(EI)
+
+
+class CP_D8(Instruction):
+    name = 'CP_D8'
+    opcode = 0xFE
+    cycles = 8
+    length = 2
+    idle_role = 'test'
+
+    def execute(self, cpu: "CPU") -> int:
+        operand = cpu.fetch_next()
+        cpu.set_alu_flags(CpFlags, operand, (cpu.reg_a - operand) & 0xFF)
+        return self.cycles
+
+    def translate(self, block: "BlockBuilder") -> Optional[int]:
+        operand = f'0x{block.fetch8():02X}'
+        block.alu_flags(CpFlags, operand, block.temp(f'({block.reg("a")} - {operand}) & 0xFF'))
+        return self.cycles
+
+
+Instruction.register(CP_D8)
 
 
-Instruction.register(LD_C_ADDR_A)
\ No newline at end of file
+OPCODES = Instruction.build_table()
+CB_OPCODES = CB_PREFIX.build_table()
@@ -0,0 +1,77 @@
+import struct
+from pygb.io import IO
+
+
+class Interrupts:
+
+    IF = 0x0F
+    IE = 0xFF
+
+    # request bits, lowest has priority
+    VBLANK = 0x01
+    STAT = 0x02
+    TIMER = 0x04
+    SERIAL = 0x08
+    JOYPAD = 0x10
+
+    VECTORS = (0x40, 0x48, 0x50, 0x58, 0x60)
+
+    # ie, if and ime
+    state_struct = struct.Struct('<2B?')
+
+    def __init__(self, *, io: IO):
+        self._enabled = 0x00
+        self._requested = 0x00
+        self._ime = False
+        # requested and enabled, which wakes a halted cpu whatever ime is
+        self.pending = 0x00
+        # pending while ime is set, the only thing the cpu looks at before each instruction
+        self.ready = 0x00
+        io.register(address=self.IF, read=self._read_if, write=self._write_if)
+        io.register(address=self.IE, read=self._read_ie, write=self._write_ie)
+
+    def get_state(self) -> tuple:
+        return self._enabled, self._requested, self._ime
+
+    def set_state(self, state: tuple):
+        self._enabled, self._requested, self._ime = state
+        self._update()
+
+    def _update(self):
+        self.pending = self._enabled & self._requested & 0x1F
+        self.ready = self.pending if self._ime else 0x00
+
+    @property
+    def ime(self) -> bool:
+        return self._ime
+
+    @ime.setter
+    def ime(self, value: bool):
+        self._ime = value
+        self._update()
+
+    def request(self, interrupt: int):
+        self._requested |= interrupt
+        self._update()
+
+    def acknowledge(self) -> int:
+        # clears the highest priority pending request and ime, returns the address to jump to
+        interrupt = self.pending & -self.pending
+        self._requested &= ~interrupt
+        self._ime = False
+        self._update()
+        return self.VECTORS[interrupt.bit_length() - 1]
+
+    def _read_if(self) -> int:
+        return 0xE0 | self._requested
+
+    def _write_if(self, value: int):
+        self._requested = value & 0x1F
+        self._update()
+
+    def _read_ie(self) -> int:
+        return self._enabled
+
+    def _write_ie(self, value: int):
+        self._enabled = value
+        self._update()
@@ -1,15 +1,70 @@
+from bisect import bisect_left, insort
+from typing import Callable, List, Optional, Set
+
+
 class IO:
 
-    def __init__(self, *, onupdate):
-        self._memory: bytearray = bytearray([0] * (0xFF80 - 0xFF00))
-        self._update_handler = onupdate
+    # hardware registers up to 0xFF7F, then hram and ie, which are plain storage unless something registers
+    SIZE = 0x10000 - 0xFF00
+
+    def __init__(self):
+        self._memory: bytearray = bytearray([0] * self.SIZE)
+        # registers without a handler are plain storage
+        self._read_handlers: List[Optional[Callable[[], int]]] = [None] * self.SIZE
+        self._write_handlers: List[Optional[Callable[[int], None]]] = [None] * self.SIZE
+        # registers with a write handler in address order, the only ones a block write stops at
+        self._handled: List[int] = []
+        # registers whose value follows the cycle count itself rather than scheduled events
+        self._clocked: Set[int] = set()
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._memory)
+
+    def register(self, *, address: int, read: Callable[[], int]=None, write: Callable[[int], None]=None,
+                 clocked: bool=False):
+        if clocked:
+            self._clocked.add(address)
+        if read is not None:
+            self._read_handlers[address] = read
+        if write is not None:
+            if self._write_handlers[address] is None:
+                insort(self._handled, address)
+            self._write_handlers[address] = write
+
+    def is_clocked(self, address: int) -> bool:
+        return address in self._clocked
 
     def read(self, *, address: int, size: int=1) -> bytearray:
-        return self._memory[address: address + size]
+        return bytearray(self.read8(current_address) for current_address in range(address, address + size))
+
+    def read8(self, address: int) -> int:
+        handler = self._read_handlers[address]
+        if handler is None:
+            return self._memory[address]
+        return handler()
 
     def write(self, *, address: int, value: bytes):
-        current_address = address
-        for byte in value:
-            self._memory[current_address] = byte
-            self._update_handler(address, byte)
-            current_address += 1
+        # plain storage between registers with handlers is copied in slices, each handler still
+        # runs in address order, after its own byte and before the ones following it
+        end = address + len(value)
+        start = address
+        handled = self._handled
+        for index in range(bisect_left(handled, address), len(handled)):
+            register = handled[index]
+            if register >= end:
+                break
+            self._memory[start:register + 1] = value[start - address:register + 1 - address]
+            self._write_handlers[register](value[register - address])
+            start = register + 1
+        self._memory[start:end] = value[start - address:]
+
+    def poke8(self, address: int, value: int):
+        # stores a value the hardware itself produced, without notifying anyone
+        self._memory[address] = value
+
+    def write8(self, address: int, value: int):
+        self._memory[address] = value
+        handler = self._write_handlers[address]
+        if handler is not None:
+            handler(value)
@@ -0,0 +1,56 @@
+import struct
+from pygb.interrupts import Interrupts
+from pygb.io import IO
+
+
+class Joypad:
+
+    P1 = 0x00
+
+    # bit of each button in its row of P1, rows are picked by bits 4 and 5
+    DIRECTIONS = {'right': 0, 'left': 1, 'up': 2, 'down': 3}
+    BUTTONS = {'a': 0, 'b': 1, 'select': 2, 'start': 3}
+
+    state_struct = struct.Struct('<3B')
+
+    def __init__(self, *, io: IO, interrupts: Interrupts):
+        self._io = io
+        self._interrupts = interrupts
+        self._select = 0x00
+        self._directions = 0x0F
+        self._buttons = 0x0F
+        io.register(address=self.P1, read=self._read_p1, write=self._write_p1)
+
+    def get_state(self) -> tuple:
+        return self._select, self._directions, self._buttons
+
+    def set_state(self, state: tuple):
+        self._select, self._directions, self._buttons = state
+
+    def _read_p1(self) -> int:
+        value = 0x0F
+        if not self._select & 0x10:
+            value &= self._directions
+        if not self._select & 0x20:
+            value &= self._buttons
+        return 0xC0 | self._select | value
+
+    def _write_p1(self, value: int):
+        self._select = value & 0x30
+
+    def press(self, button: str):
+        # a line of the selected row going low is what raises the interrupt
+        if button in self.DIRECTIONS:
+            self._directions &= ~(1 << self.DIRECTIONS[button])
+            selected = not self._select & 0x10
+        else:
+            self._buttons &= ~(1 << self.BUTTONS[button])
+            selected = not self._select & 0x20
+        if selected:
+            self._interrupts.request(Interrupts.JOYPAD)
+
+    def release(self, button: str):
+        if button in self.DIRECTIONS:
+            self._directions |= 1 << self.DIRECTIONS[button]
+        else:
+            self._buttons |= 1 << self.BUTTONS[button]
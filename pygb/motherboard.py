@@ -1,42 +1,135 @@
+import struct
 from pygb.boot import Boot
 from pygb.bus import Bus
 from pygb.cpu import CPU
 from pygb.vram import VRAM
 from pygb.cart import Cart
+from pygb.interrupts import Interrupts
 from pygb.io import IO
-from pygb.apu import APU
+from pygb.joypad import Joypad
+from pygb.oam import OAM
+from pygb.ppu import PPU, VideoSink
+from pygb.apu import APU, AudioSink
+from pygb.scheduler import Scheduler
+from pygb.serial import Serial
+from pygb.timer import Timer
+from pygb.trace import Tracer
+from pygb.wram import WRAM
+from typing import Callable, Dict, Tuple
 
 class Motherboard:
 
-    def __init__(self):
+    # emulated cycles between flushes of dirty battery backed ram, about a second
+    SAVE_FLUSH_INTERVAL = 4194304
+
+    STATE_MAGIC = b'PYGB'
+    STATE_VERSION = 4
+    # magic, version and ticks, followed by every part's struct and then the raw memories
+    state_header = struct.Struct('<4sHQ')
+
+    # why run_until returned
+    STOP_CYCLES = 'cycles'
+    STOP_FRAMES = 'frames'
+    STOP_PC = 'pc'
+    STOP_SERIAL = 'serial'
+    STOP_PREDICATE = 'predicate'
+
+    def __init__(self, *, tracer: Tracer=None, headless: bool=False, audio_sink: AudioSink=None,
+                 video_sink: VideoSink=None, fast_boot: bool=None, rom: str=None, recompile: bool=False,
+                 idle_skip: bool=True):
+        if fast_boot is None:
+            fast_boot = headless
         self._boot = Boot(path='boot/dmg_boot.bin')
-        self._boot.load_boot()
+        if not fast_boot:
+            self._boot.load_boot()
         self._vram = VRAM()
+        self._oam = OAM()
+        self._wram = WRAM()
         self._cart = Cart()
-        self._io = IO(onupdate=self.io_update_handler)
-        self._bus = Bus(boot=self._boot, vram=self._vram, cart=self._cart, io=self._io)
-        self._cpu = CPU(motherboard=self)
-        self._apu = APU()
+        if rom is not None:
+            self._cart.load(path=rom)
+        self._scheduler = Scheduler()
+        self._io = IO()
+        self._interrupts = Interrupts(io=self._io)
+        self._joypad = Joypad(io=self._io, interrupts=self._interrupts)
+        self._serial = Serial(io=self._io, interrupts=self._interrupts)
+        self._serial.listen(self._check_serial)
+        self._timer = Timer(io=self._io, interrupts=self._interrupts, scheduler=self._scheduler,
+                            clock=lambda: self._ticks)
+        self._serial_stop: int = None
+        self._stop: str = None
+        self._bus = Bus(boot=None if fast_boot else self._boot, vram=self._vram, cart=self._cart, io=self._io,
+                        oam=self._oam, wram=self._wram)
+        self._ppu = PPU(vram=self._vram, oam=self._oam, io=self._io, interrupts=self._interrupts,
+                        scheduler=self._scheduler, sink=video_sink)
+        self._tracer = tracer if tracer is not None else Tracer()
+        # polling loops are skipped up to the next event unless idle_skip is off
+        self._cpu = CPU(motherboard=self, tracer=tracer, recompile=recompile, idle_skip=idle_skip)
+        if audio_sink is None and not headless:
+            # only a real frontend pays for importing and initializing sdl
+            from pygb.sdl import SDLAudioSink
+            audio_sink = SDLAudioSink(sample_rate=APU.sample_rate, channels=APU.channels)
+        self._apu = APU(scheduler=self._scheduler, io=self._io, sink=audio_sink)
         self._ticks = 0
+        self._flush_event = None
+        if self._cart.ram is not None:
+            self._flush_event = self._scheduler.schedule(at=self.SAVE_FLUSH_INTERVAL, callback=self._flush_cart_ram)
+        self._state_parts = [self._cpu, self._cart.mbc, self._bus, self._joypad, self._interrupts,
+                             self._timer, self._ppu, self._apu]
+        # offset and size of everything in a saved state, the parts' structs come first as one region
+        offset = self.state_header.size + sum(part.state_struct.size for part in self._state_parts)
+        self._state_regions: Dict[str, Tuple[int, int]] = {'parts': (0, offset)}
+        for name, memory in self._state_memories().items():
+            self._state_regions[name] = (offset, len(memory))
+            offset += len(memory)
+        self._state_size = offset
+        if fast_boot:
+            self._boot.apply_post_boot_state(cpu=self._cpu, io=self._io, vram=self._vram, cart=self._cart,
+                                             timer=self._timer, interrupts=self._interrupts)
+
+    @property
+    def bus(self) -> Bus:
+        return self._bus
+
+    @property
+    def cpu(self) -> CPU:
+        return self._cpu
+
+    @property
+    def interrupts(self) -> Interrupts:
+        return self._interrupts
+
+    @property
+    def io(self) -> IO:
+        return self._io
+
+    @property
+    def joypad(self) -> Joypad:
+        return self._joypad
+
+    @property
+    def ppu(self) -> PPU:
+        return self._ppu
+
+    @property
+    def scheduler(self) -> Scheduler:
+        return self._scheduler
+
+    @property
+    def serial(self) -> Serial:
+        return self._serial
 
-    def io_update_handler(self, address: int, value: bytes):
-        address = address + 0xFF00
-        if address == 0xFF11:  # nr11 channel 1 wave pattern
-            self._apu.nr11 = value
-            return
-        if address == 0xFF12:  # nr12 channel 1 envelop
-            self._apu.nr12 = value
-            return
-        if address == 0xFF24:  # nr50 output channel control
-            self._apu.nr50 = value
-            return
-        if address == 0xFF25:  # nr51 output terminal selection
-            self._apu.nr51 = value
-            return
-        if address == 0xFF26:  # nr52 sound on/off
-            self._apu.nr52 = value
-            return
-        raise Exception(f'Unknown IO Register 0x{address:04X}')
+    @property
+    def ticks(self) -> int:
+        return self._ticks
+
+    @property
+    def timer(self) -> Timer:
+        return self._timer
+
+    @property
+    def tracer(self) -> Tracer:
+        return self._tracer
 
     def read(self, *, address: int, size: int=1):
         return self._bus.read(address=address, size=size)
@@ -48,8 +141,107 @@ class Motherboard:
         self._ticks += cycles
 
     def run(self):
-        while True:
-            self._cpu.tick()
+        self.run_until()
+
+    def run_for(self, *, cycles: int) -> str:
+        return self.run_until(cycles=cycles)
+
+    def run_until(self, *, cycles: int=None, frames: int=None, pc: int=None, serial: int=None,
+                  predicate: Callable[["Motherboard"], bool]=None) -> str:
+        # the cpu runs uninterrupted up to the nearest scheduled event, so peripherals only cost
+        # anything when one of their events is due, and stop conditions are checked between events.
+        # frames counts completed frames from now, the predicate is called at every event boundary
+        scheduler, cpu = self._scheduler, self._cpu
+        # the cycle budget is an event like any other, so the inner loops only ever compare against the deadline
+        end = None if cycles is None else scheduler.schedule(at=self._ticks + cycles, callback=self._end_cycles)
+        last_frame = None if frames is None else self._ppu.frame_count + frames
+        self._serial_stop, self._stop = serial, None
+        try:
+            while True:
+                if pc is None:
+                    tick = cpu.tick
+                    while self._ticks < scheduler.deadline:
+                        tick()
+                else:
+                    step = cpu.step
+                    while self._ticks < scheduler.deadline:
+                        step()
+                        if cpu.reg_pc == pc:
+                            return self.STOP_PC
+                scheduler.run_due(self._ticks)
+                if self._stop is not None:
+                    return self._stop
+                if last_frame is not None and self._ppu.frame_count >= last_frame:
+                    return self.STOP_FRAMES
+                if predicate is not None and predicate(self):
+                    return self.STOP_PREDICATE
+        finally:
+            self._serial_stop = None
+            if end is not None:
+                scheduler.cancel(end)
+
+    def _end_cycles(self, at: int):
+        self._stop = self.STOP_CYCLES
+
+    def _check_serial(self, byte: int):
+        if byte == self._serial_stop:
+            self._stop = self.STOP_SERIAL
+            self._scheduler.expire()
+
+    def _flush_cart_ram(self, at: int):
+        self._cart.flush()
+        self._flush_event = self._scheduler.schedule(at=at + self.SAVE_FLUSH_INTERVAL, callback=self._flush_cart_ram)
+
+    @property
+    def state_regions(self) -> Dict[str, Tuple[int, int]]:
+        return self._state_regions
+
+    def _state_memories(self) -> Dict[str, memoryview]:
+        memories = {'vram': self._vram.memory, 'wram': self._wram.memory, 'oam': self._oam.memory,
+                    'io': self._io.memory, 'framebuffer': memoryview(self._ppu.framebuffer).cast('B')}
+        if self._cart.ram is not None:
+            memories['cart_ram'] = self._cart.ram.memory
+        return memories
+
+    def save_state(self) -> bytearray:
+        # packed straight into one preallocated buffer, the memories are copied with slice assignments
+        state = bytearray(self._state_size)
+        self.state_header.pack_into(state, 0, self.STATE_MAGIC, self.STATE_VERSION, self._ticks)
+        offset = self.state_header.size
+        for part in self._state_parts:
+            part.state_struct.pack_into(state, offset, *part.get_state())
+            offset += part.state_struct.size
+        for memory in self._state_memories().values():
+            state[offset:offset + len(memory)] = memory
+            offset += len(memory)
+        return state
+
+    def load_state(self, state: bytes):
+        state = memoryview(state)
+        if len(state) != self._state_size:
+            raise Exception(f'State of {len(state)} bytes does not fit this machine, expected {self._state_size}')
+        magic, version, ticks = self.state_header.unpack_from(state)
+        if magic != self.STATE_MAGIC or version != self.STATE_VERSION:
+            raise Exception(f'Unsupported state {magic!r} version {version}')
+        self._ticks = ticks
+        offset = self.state_header.size
+        for part in self._state_parts:
+            part.set_state(part.state_struct.unpack_from(state, offset))
+            offset += part.state_struct.size
+        # restored in place, everything holding a view on these buffers keeps seeing them
+        for memory in self._state_memories().values():
+            memory[:] = state[offset:offset + len(memory)]
+            offset += len(memory)
+        self._vram.invalidate()
+        self._oam.invalidate()
+        if self._cart.ram is not None:
+            self._cart.ram.mark_dirty()
+            self._scheduler.cancel(self._flush_event)
+            self._flush_event = self._scheduler.schedule(at=ticks + self.SAVE_FLUSH_INTERVAL,
+                                                         callback=self._flush_cart_ram)
 
     def close(self):
+        self._cart.flush()
         self._apu.close()
+        self._ppu.close()
+        self._tracer.close()
@@ -0,0 +1,39 @@
+from typing import List, Set
+
+
+class OAM:
+
+    SPRITE_COUNT = 40
+    SPRITES_END = 0xA0
+
+    def __init__(self):
+        # 40 sprites of 4 bytes, followed by the unusable area up to 0xFF00
+        self._memory: bytearray = bytearray([0] * (0xFF00 - 0xFE00))
+        # sprites whose y changed since the ppu last indexed them, nothing else decides which lines they are on
+        self._dirty_sprites: Set[int] = set(range(self.SPRITE_COUNT))
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._memory)
+
+    def read(self, *, address: int, size: int=1) -> bytearray:
+        return self._memory[address: address + size]
+
+    def write(self, *, address: int, value: bytes):
+        end = address + len(value)
+        self._memory[address:end] = value
+        if address < self.SPRITES_END:
+            self._dirty_sprites.update(range(address >> 2, ((min(end, self.SPRITES_END) - 1) >> 2) + 1))
+
+    def write8(self, address: int, value: int):
+        self._memory[address] = value
+        if address < self.SPRITES_END and not address & 0x03:
+            self._dirty_sprites.add(address >> 2)
+
+    def invalidate(self):
+        self._dirty_sprites.update(range(self.SPRITE_COUNT))
+
+    def take_dirty_sprites(self) -> List[int]:
+        sprites = list(self._dirty_sprites)
+        self._dirty_sprites.clear()
+        return sprites
@@ -0,0 +1,261 @@
+import numpy as np
+import struct
+from bisect import insort
+from pygb.interrupts import Interrupts
+from pygb.io import IO
+from pygb.oam import OAM
+from pygb.scheduler import Scheduler
+from pygb.vram import VRAM
+from typing import List
+
+
+class VideoSink:
+    # discards every frame, used when nothing is displayed
+
+    def present(self, framebuffer: np.ndarray):
+        pass
+
+    def close(self):
+        pass
+
+
+class RawFileVideoSink(VideoSink):
+
+    def __init__(self, *, path: str):
+        self._file = open(path, 'wb')
+
+    def present(self, framebuffer: np.ndarray):
+        # one 160x144 frame of 0-3 shades per record
+        self._file.write(framebuffer.tobytes())
+
+    def close(self):
+        self._file.close()
+
+
+class PPU:
+
+    WIDTH = 160
+    HEIGHT = 144
+    LINES = 154
+    LINE_CYCLES = 456
+    # oam scan (mode 2) and pixel transfer (mode 3), hblank (mode 0) takes the rest of a shown line
+    OAM_SCAN_CYCLES = 80
+    TRANSFER_CYCLES = 172
+
+    # io register offsets from 0xFF00
+    LCDC = 0x40
+    STAT = 0x41
+    SCY = 0x42
+    SCX = 0x43
+    LY = 0x44
+    LYC = 0x45
+    BGP = 0x47
+    OBP0 = 0x48
+    OBP1 = 0x49
+    WY = 0x4A
+    WX = 0x4B
+
+    # sprites a line can show
+    LINE_SPRITES = 10
+
+    # stat bits selecting what raises the stat interrupt
+    STAT_HBLANK = 0x08
+    STAT_VBLANK = 0x10
+    STAT_OAM = 0x20
+    STAT_LYC = 0x40
+
+    MAP_0 = 0x1800
+    MAP_1 = 0x1C00
+
+    # ly, mode, stat, window line, frame count, whether the lcd was on and the cycle the current mode ends at
+    state_struct = struct.Struct('<4BI?Q')
+
+    def __init__(self, *, vram: VRAM, oam: OAM, io: IO, interrupts: Interrupts, scheduler: Scheduler,
+                 sink: VideoSink=None):
+        self._vram = vram
+        self._oam = oam
+        self._interrupts = interrupts
+        self._sink = sink if sink is not None else VideoSink()
+        self._io = io
+        self._scheduler = scheduler
+        self._vram_memory = np.frombuffer(vram.memory, dtype=np.uint8)
+        self._oam_memory = np.frombuffer(oam.memory, dtype=np.uint8)[:0xA0].reshape(40, 4)
+        self._tiles = np.zeros((VRAM.TILE_COUNT, 8, 8), dtype=np.uint8)
+        # tile numbers for the 0x8800 addressing mode, where map entries are signed
+        self._signed_tiles = np.array([256 + index if index < 128 else index for index in range(256)])
+        self._columns = np.arange(self.WIDTH)
+        # oam indices of the sprites covering each line in oam order, and the lines each sprite was indexed on
+        self._line_sprites: List[List[int]] = [[] for _ in range(self.HEIGHT)]
+        self._sprite_lines: List[range] = [range(0) for _ in range(OAM.SPRITE_COUNT)]
+        self._sprite_height = 8
+        self._window_line = 0
+        self.ly = 0
+        self._mode = 2
+        self._stat = 0x00
+        # false after a line the lcd was off for, the next one starts the frame over
+        self._lcd_on = True
+        io.register(address=self.LY, read=self._read_ly)
+        io.register(address=self.STAT, read=self._read_stat, write=self._write_stat)
+        self.framebuffer = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        self.frame_count = 0
+        self._mode_event = self._scheduler.schedule(at=self.OAM_SCAN_CYCLES, callback=self._end_oam_scan)
+
+    def get_state(self) -> tuple:
+        return (self.ly, self._mode, self._stat, self._window_line, self.frame_count, self._lcd_on,
+                self._mode_event.at)
+
+    def set_state(self, state: tuple):
+        self.ly, self._mode, self._stat, self._window_line, self.frame_count, self._lcd_on, mode_end = state
+        self._scheduler.cancel(self._mode_event)
+        callback = {2: self._end_oam_scan, 3: self._end_transfer}.get(self._mode, self._end_line)
+        self._mode_event = self._scheduler.schedule(at=mode_end, callback=callback)
+
+    def _read_ly(self) -> int:
+        return self.ly if self._io.read8(self.LCDC) & 0x80 else 0
+
+    def _read_stat(self) -> int:
+        ly, mode = (self.ly, self._mode) if self._io.read8(self.LCDC) & 0x80 else (0, 0)
+        coincidence = 0x04 if ly == self._io.read8(self.LYC) else 0x00
+        return 0x80 | self._stat | coincidence | mode
+
+    def _write_stat(self, value: int):
+        # only the interrupt selection bits are writable
+        self._stat = value & 0x78
+
+    def _end_oam_scan(self, at: int):
+        self._mode = 3
+        self._mode_event = self._scheduler.schedule(at=at + self.TRANSFER_CYCLES, callback=self._end_transfer)
+
+    def _end_transfer(self, at: int):
+        # the line is drawn with the registers as they are when its pixels go out
+        if self._io.read8(self.LCDC) & 0x80:
+            self._render_line(self.ly)
+        self._mode = 0
+        if self._stat & self.STAT_HBLANK:
+            self._interrupts.request(Interrupts.STAT)
+        self._mode_event = self._scheduler.schedule(
+            at=at + self.LINE_CYCLES - self.OAM_SCAN_CYCLES - self.TRANSFER_CYCLES, callback=self._end_line)
+
+    def _end_line(self, at: int):
+        io = self._io
+        if not io.read8(self.LCDC) & 0x80:
+            self.ly, self._mode, self._lcd_on = 0, 0, False
+            self._mode_event = self._scheduler.schedule(at=at + self.LINE_CYCLES, callback=self._end_line)
+            return
+        ly = (self.ly + 1) % self.LINES if self._lcd_on else 0
+        self._lcd_on = True
+        if ly == self.HEIGHT:
+            self.frame_count += 1
+            self._window_line = 0
+            self._sink.present(self.framebuffer)
+            self._interrupts.request(Interrupts.VBLANK | (Interrupts.STAT if self._stat & self.STAT_VBLANK else 0))
+        if self._stat & self.STAT_LYC and ly == io.read8(self.LYC):
+            self._interrupts.request(Interrupts.STAT)
+        self.ly = ly
+        if ly >= self.HEIGHT:
+            self._mode = 1
+            self._mode_event = self._scheduler.schedule(at=at + self.LINE_CYCLES, callback=self._end_line)
+            return
+        self._mode = 2
+        if self._stat & self.STAT_OAM:
+            self._interrupts.request(Interrupts.STAT)
+        self._mode_event = self._scheduler.schedule(at=at + self.OAM_SCAN_CYCLES, callback=self._end_oam_scan)
+
+    def close(self):
+        self._sink.close()
+
+    def _decode_tiles(self):
+        dirty = self._vram.take_dirty_tiles()
+        if not dirty:
+            return
+        rows = self._vram_memory[:VRAM.TILE_DATA_END].reshape(VRAM.TILE_COUNT, 8, 2)[dirty]
+        low = np.unpackbits(rows[:, :, 0, np.newaxis], axis=2)
+        high = np.unpackbits(rows[:, :, 1, np.newaxis], axis=2)
+        self._tiles[dirty] = low | (high << 1)
+
+    def _palette(self, register: int) -> np.ndarray:
+        value = self._io.read8(register)
+        return np.array([(value >> shift) & 0x03 for shift in (0, 2, 4, 6)], dtype=np.uint8)
+
+    def _fetch(self, *, lcdc: int, map_start: int, y: int, xs: np.ndarray) -> np.ndarray:
+        tiles = self._vram_memory[map_start + (y >> 3) * 32 + (xs >> 3)]
+        if not lcdc & 0x10:
+            tiles = self._signed_tiles[tiles]
+        return self._tiles[tiles, y & 0x07, xs & 0x07]
+
+    def _render_line(self, ly: int):
+        self._decode_tiles()
+        io = self._io
+        lcdc = io.read8(self.LCDC)
+        background = np.zeros(self.WIDTH, dtype=np.uint8)
+        if lcdc & 0x01:
+            xs = (self._columns + io.read8(self.SCX)) & 0xFF
+            background[:] = self._fetch(lcdc=lcdc, map_start=self.MAP_1 if lcdc & 0x08 else self.MAP_0,
+                                        y=(ly + io.read8(self.SCY)) & 0xFF, xs=xs)
+            window_x = io.read8(self.WX) - 7
+            if lcdc & 0x20 and ly >= io.read8(self.WY) and window_x < self.WIDTH:
+                start = max(window_x, 0)
+                xs = self._columns[:self.WIDTH - start] + (start - window_x)
+                background[start:] = self._fetch(lcdc=lcdc, map_start=self.MAP_1 if lcdc & 0x40 else self.MAP_0,
+                                                 y=self._window_line, xs=xs)
+                self._window_line += 1
+        line = self.framebuffer[ly]
+        line[:] = self._palette(self.BGP)[background]
+        if lcdc & 0x02:
+            self._render_sprites(ly=ly, lcdc=lcdc, line=line, background=background)
+
+    def _index_sprites(self, height: int):
+        # moves only the sprites whose y changed, or all of them after the sprite size did
+        if height != self._sprite_height:
+            self._sprite_height = height
+            self._oam.invalidate()
+        dirty = self._oam.take_dirty_sprites()
+        if not dirty:
+            return
+        line_sprites, sprite_lines, memory = self._line_sprites, self._sprite_lines, self._oam_memory
+        if len(dirty) == OAM.SPRITE_COUNT:
+            for sprites in line_sprites:
+                sprites.clear()
+            for index in range(OAM.SPRITE_COUNT):
+                top = int(memory[index, 0]) - 16
+                lines = sprite_lines[index] = range(max(top, 0), min(top + height, self.HEIGHT))
+                for ly in lines:
+                    line_sprites[ly].append(index)
+            return
+        for index in dirty:
+            for ly in sprite_lines[index]:
+                line_sprites[ly].remove(index)
+            top = int(memory[index, 0]) - 16
+            lines = sprite_lines[index] = range(max(top, 0), min(top + height, self.HEIGHT))
+            for ly in lines:
+                insort(line_sprites[ly], index)
+
+    def _render_sprites(self, *, ly: int, lcdc: int, line: np.ndarray, background: np.ndarray):
+        height = 16 if lcdc & 0x04 else 8
+        self._index_sprites(height)
+        candidates = self._line_sprites[ly][:self.LINE_SPRITES]
+        if not candidates:
+            return
+        sprites = [(self._oam_memory[index].tolist(), index) for index in candidates]
+        palettes = (self._palette(self.OBP0), self._palette(self.OBP1))
+        # drawn from lowest to highest priority: smaller x wins, then lower oam index
+        for (y, x, tile, attributes), index in sorted(sprites, key=lambda sprite: (sprite[0][1], sprite[1]),
+                                                      reverse=True):
+            row = ly - (y - 16)
+            if attributes & 0x40:
+                row = height - 1 - row
+            if height == 16:
+                tile &= 0xFE
+            pixels = self._tiles[tile + (row >> 3), row & 0x07]
+            if attributes & 0x20:
+                pixels = pixels[::-1]
+            left = x - 8
+            start, end = max(left, 0), min(left + 8, self.WIDTH)
+            if start >= end:
+                continue
+            pixels = pixels[start - left: end - left]
+            mask = pixels != 0
+            if attributes & 0x80:
+                mask &= background[start:end] == 0
+            segment = line[start:end]
+            segment[mask] = palettes[(attributes >> 4) & 0x01][pixels[mask]]
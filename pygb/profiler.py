@@ -0,0 +1,144 @@
+import json
+from collections import Counter
+from pygb.instructions import CB_PREFIX, Instruction
+from typing import Dict, List, TextIO, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.bus import Bus
+
+# first address of each region, in address order
+REGIONS = [
+    ('rom0', 0x0000),
+    ('romx', 0x4000),
+    ('vram', 0x8000),
+    ('exram', 0xA000),
+    ('wram', 0xC000),
+    ('echo', 0xE000),
+    ('oam', 0xFE00),
+    ('unusable', 0xFEA0),
+    ('io', 0xFF00),
+    ('hram', 0xFF80),
+    ('ie', 0xFFFF),
+]
+REGION_NAMES = [name for name, _ in REGIONS]
+# region index of every address, one lookup instead of a search per access
+REGION_OF = bytes(index for index, (_, start) in enumerate(REGIONS)
+                  for _ in range(start, REGIONS[index + 1][1] if index + 1 < len(REGIONS) else 0x10000))
+CB_KEY = 0x100
+
+
+class CountingBus:
+    # stands in for the bus while profiling, the cpu reaches memory through it and nothing else changes
+
+    def __init__(self, *, bus: "Bus", reads: List[int], writes: List[int]):
+        self._bus = bus
+        self._reads = reads
+        self._writes = writes
+
+    def __getattr__(self, name: str):
+        return getattr(self._bus, name)
+
+    def read8(self, address: int) -> int:
+        self._reads[REGION_OF[address]] += 1
+        return self._bus.read8(address)
+
+    def write8(self, address: int, value: int):
+        self._writes[REGION_OF[address]] += 1
+        self._bus.write8(address, value)
+
+
+class Profiler:
+
+    def __init__(self, *, sample_interval: int=64):
+        # timing every instruction would measure mostly the clock, so only every nth one is timed
+        self._sample_interval = sample_interval
+        self._countdown = sample_interval
+        self.counts: List[int] = [0] * 0x200
+        self.samples: List[int] = [0] * 0x200
+        self.sampled_ns: List[int] = [0] * 0x200
+        self.pcs: Counter = Counter()
+        self.reads: List[int] = [0] * len(REGIONS)
+        self.writes: List[int] = [0] * len(REGIONS)
+
+    @property
+    def instructions(self) -> int:
+        return sum(self.counts)
+
+    def counting_bus(self, bus: "Bus") -> CountingBus:
+        return CountingBus(bus=bus, reads=self.reads, writes=self.writes)
+
+    def count(self, bank: int, pc: int, key: int) -> bool:
+        # returns whether this instruction is one to time
+        self.counts[key] += 1
+        self.pcs[(bank, pc, key)] += 1
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self._sample_interval
+        return True
+
+    def sample(self, key: int, ns: int):
+        self.samples[key] += 1
+        self.sampled_ns[key] += ns
+
+    @staticmethod
+    def name(key: int) -> str:
+        instructions = CB_PREFIX.instructions if key & CB_KEY else Instruction.instructions
+        instruction = instructions.get(key & 0xFF)
+        if instruction is None:
+            return f'{"CB_" if key & CB_KEY else ""}0x{key & 0xFF:02X}'
+        return instruction.name
+
+    @staticmethod
+    def location(bank: int, pc: int) -> str:
+        if bank < 0:
+            return 'boot'
+        if pc < 0x8000:
+            return f'bank_{bank:02X}'
+        return REGION_NAMES[REGION_OF[pc]]
+
+    def estimated_ns(self, key: int) -> float:
+        # the mean of the timed executions stands in for the untimed ones
+        if not self.samples[key]:
+            return 0.0
+        return self.sampled_ns[key] / self.samples[key] * self.counts[key]
+
+    def to_dict(self) -> Dict[str, object]:
+        hot_pcs: Dict[str, Dict[str, int]] = {}
+        for (bank, pc, key), count in self.pcs.most_common():
+            location = hot_pcs.setdefault(self.location(bank, pc), {})
+            location[f'0x{pc:04X}'] = location.get(f'0x{pc:04X}', 0) + count
+        return {
+            'instructions': self.instructions,
+            'sample_interval': self._sample_interval,
+            'opcodes': {
+                f'{"CB" if key & CB_KEY else ""}{key & 0xFF:02X}': {
+                    'name': self.name(key),
+                    'count': self.counts[key],
+                    'samples': self.samples[key],
+                    'sampled_ns': self.sampled_ns[key],
+                    'estimated_ns': self.estimated_ns(key),
+                }
+                for key in range(len(self.counts)) if self.counts[key]
+            },
+            'hot_pcs': hot_pcs,
+            'bus': {name: {'reads': self.reads[index], 'writes': self.writes[index]}
+                    for index, name in enumerate(REGION_NAMES) if self.reads[index] or self.writes[index]},
+        }
+
+    def dump_json(self, stream: TextIO):
+        json.dump(self.to_dict(), stream, indent=2)
+
+    def collapsed_stacks(self, *, weight: str='count') -> List[str]:
+        # location;pc;instruction frames, weighted by executions or by estimated nanoseconds
+        stacks: List[Tuple[str, int]] = []
+        for (bank, pc, key), count in sorted(self.pcs.items()):
+            if weight == 'time':
+                value = round(self.estimated_ns(key) * count / self.counts[key])
+            else:
+                value = count
+            if value:
+                stacks.append((f'{self.location(bank, pc)};0x{pc:04X};{self.name(key)}', value))
+        return [f'{stack} {value}\n' for stack, value in stacks]
+
+    def dump_collapsed(self, stream: TextIO, *, weight: str='count'):
+        stream.writelines(self.collapsed_stacks(weight=weight))
@@ -0,0 +1,267 @@
+from collections import defaultdict
+from pygb.flags import AluFlags
+from pygb.instructions import Instruction
+from typing import Callable, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.bus import Bus
+    from pygb.cpu import CPU
+
+
+class BlockBuilder:
+
+    MAX_INSTRUCTIONS = 64
+
+    def __init__(self, *, bus: "Bus", pc: int):
+        self._bus = bus
+        self.start = pc
+        self.pc = pc
+        self.cycles = 0
+        self.size = 0
+        self.flag_ops: Dict[str, AluFlags] = {}
+        self._lines = []
+        self._temps = 0
+        # registers read before the block assigned them, loaded in the prologue
+        self._inputs: Set[str] = set()
+        self._assigned: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._consts: Dict[str, int] = {}
+        # expression holding the result of the last alu op, zero exactly when flag z is set
+        self._zero: Optional[str] = None
+        self._flags_line: Optional[int] = None
+        self._branch: Optional[Tuple[str, int, int]] = None
+        self._loop_end: Optional[int] = None
+        # start of the instruction being translated, and the run time test for leaving the block after it
+        self.instruction = pc
+        self._exit_after: Optional[str] = None
+
+    @property
+    def ended(self) -> bool:
+        return self._branch is not None
+
+    def fetch8(self) -> int:
+        value = self._bus.read8(self.pc)
+        self.pc = (self.pc + 1) & 0xFFFF
+        return value
+
+    def fetch16(self) -> int:
+        lsb = self.fetch8()
+        return (self.fetch8() << 8) | lsb
+
+    def emit(self, line: str):
+        self._lines.append(line)
+
+    @staticmethod
+    def _constant(expr: str) -> Optional[int]:
+        code = compile(expr, '<block>', 'eval')
+        if code.co_names:
+            return None
+        return eval(code, {})
+
+    def fold(self, expr: str) -> str:
+        value = self._constant(expr)
+        return expr if value is None else f'0x{value:02X}'
+
+    def temp(self, expr: str) -> str:
+        if self._constant(expr) is not None:
+            return self.fold(expr)
+        name = f't{self._temps}'
+        self._temps += 1
+        self.emit(f'{name} = {expr}')
+        return name
+
+    def reg(self, name: str) -> str:
+        if name in self._consts:
+            return f'0x{self._consts[name]:02X}'
+        if name not in self._assigned:
+            self._inputs.add(name)
+            self._assigned.add(name)
+        return name
+
+    def reg16(self, pair: str) -> str:
+        if pair == 'sp':
+            return self.reg('sp')
+        return self.fold(f'(({self.reg(pair[0])} << 8) | {self.reg(pair[1])})')
+
+    def set_reg(self, name: str, expr: str, mask: int=0xFF):
+        self._zero = None
+        self._assigned.add(name)
+        self._dirty.add(name)
+        value = self._constant(expr)
+        if value is not None:
+            self._consts[name] = value & mask
+            return
+        self._consts.pop(name, None)
+        self.emit(f'{name} = ({expr}) & 0x{mask:X}')
+
+    def set_reg16(self, pair: str, expr: str):
+        if pair == 'sp':
+            return self.set_reg('sp', expr, mask=0xFFFF)
+        value = self.temp(f'({expr}) & 0xFFFF')
+        self.set_reg(pair[0], f'({value}) >> 8')
+        self.set_reg(pair[1], value)
+
+    @classmethod
+    def is_io(cls, address: str) -> Optional[bool]:
+        # the io registers and ie, hram is plain memory. None when the address is only known at run time
+        value = cls._constant(address)
+        if value is None:
+            return None
+        return value >= 0xFF00 and not 0xFF80 <= value < 0xFFFF
+
+    def io_access(self, address: str) -> bool:
+        # io registers see the cycle count and the events run as of the start of the block, so an access to one
+        # has to start a block, false when the instruction is left for the next block
+        return not self.size or not self.is_io(address)
+
+    def write8(self, address: str, value: str) -> bool:
+        # a write to the io registers ends the block, so an interrupt or event it brings forward is seen right after
+        address = self.fold(address)
+        io = self.is_io(address)
+        if io is None and self.size:
+            self.exit(f'{address} >= 0xFF00', pc=self.instruction, cycles=self.cycles)
+        elif not self.io_access(address):
+            return False
+        self.emit(f'write8({address}, {self.fold(value)})')
+        if io:
+            self.stop()
+        elif io is None:
+            self._exit_after = f'{address} >= 0xFF00'
+        return True
+
+    def alu_flags(self, op: AluFlags, operand: str, result: str):
+        if op.keep == 0 and self._flags_line is not None:
+            # nothing read the previous flags before this op overwrote all of them
+            self._lines[self._flags_line] = 'pass'
+        self.flag_ops[op.__name__] = op
+        self._flags_line = len(self._lines)
+        self.emit(f'set_alu_flags({op.__name__}, {operand}, {result})')
+        self._zero = result if op.z_from_result else None
+
+    def not_zero(self) -> str:
+        if self._zero is not None:
+            return f'({self._zero}) != 0'
+        self._flags_line = None
+        return 'not cpu.flag_z'
+
+    def branch(self, *, condition: str, target: int, extra_cycles: int, loop: bool=False):
+        # a loop branch tells the cpu when it is taken, which may skip the passes that follow
+        taken = self._constant(condition)
+        self._loop_end = self.pc if loop else None
+        if taken is None:
+            self._branch = (condition, target, extra_cycles)
+        elif taken:
+            self._branch = ('True', target, extra_cycles)
+        else:
+            self._branch = ('False', self.pc, 0)
+
+    def stop(self):
+        # ends the block after the instruction being translated
+        self._branch = ('False', self.pc, 0)
+        self._exit_after = None
+
+    def exit(self, condition: str, *, pc: int, cycles: int):
+        # leaves the block early with every register it changed so far, whose flags are then seen too
+        self._flags_line = None
+        self.emit(f'if {condition}:')
+        self._lines += [f'    {line}' for line in self._writeback()]
+        self.emit(f'    cpu.reg_pc = 0x{pc:04X}')
+        self.emit(f'    return {cycles}')
+
+    def end_instruction(self, cycles: int):
+        self.cycles += cycles
+        self.size += 1
+        if self._exit_after is not None:
+            self.exit(self._exit_after, pc=self.pc, cycles=self.cycles)
+            self._exit_after = None
+
+    def _writeback(self) -> List[str]:
+        lines = []
+        for register in sorted(self._dirty):
+            value = self._consts.get(register)
+            lines.append(f'cpu.reg_{register} = {register if value is None else f"0x{value:02X}"}')
+        return lines
+
+    def source(self, name: str) -> str:
+        lines = [f'def {name}(cpu):']
+        if self.flag_ops:
+            lines.append('    set_alu_flags = cpu.set_alu_flags')
+        lines += [f'    {register} = cpu.reg_{register}' for register in sorted(self._inputs)]
+        lines += [f'    {line}' for line in self._lines]
+        lines += [f'    {line}' for line in self._writeback()]
+        pc, cycles = self.pc, self.cycles
+        if self._branch is not None:
+            condition, target, extra_cycles = self._branch
+            if condition == 'True':
+                pc, cycles = target, cycles + extra_cycles
+                if self._loop_end is not None:
+                    lines.append(f'    cpu.loop_back(0x{target:04X}, 0x{self._loop_end:04X}, {cycles})')
+            elif condition != 'False':
+                lines.append(f'    if {condition}:')
+                lines.append(f'        cpu.reg_pc = 0x{target:04X}')
+                if self._loop_end is not None:
+                    lines.append(f'        cpu.loop_back(0x{target:04X}, 0x{self._loop_end:04X}, '
+                                 f'{cycles + extra_cycles})')
+                lines.append(f'        return {cycles + extra_cycles}')
+        lines.append(f'    cpu.reg_pc = 0x{pc:04X}')
+        lines.append(f'    return {cycles}')
+        return '\n'.join(lines) + '\n'
+
+
+class Recompiler:
+
+    def __init__(self, *, bus: "Bus"):
+        self._bus = bus
+        self._blocks: Dict[Tuple[int, int], Optional[Callable[["CPU"], int]]] = {}
+        self._page_blocks: Dict[int, Set[Tuple[int, int]]] = defaultdict(set)
+        self._globals = {'write8': bus.write8, 'read8': bus.read8}
+
+    def get_block(self, pc: int) -> Optional[Callable[["CPU"], int]]:
+        key = (self._bus.code_bank(pc), pc)
+        try:
+            return self._blocks[key]
+        except KeyError:
+            block = self._blocks[key] = self._compile(key)
+            return block
+
+    def _compile(self, key: Tuple[int, int]) -> Optional[Callable[["CPU"], int]]:
+        bank, pc = key
+        builder = BlockBuilder(bus=self._bus, pc=pc)
+        while builder.size < builder.MAX_INSTRUCTIONS and not builder.ended:
+            start = builder.instruction = builder.pc
+            if start >> 8 != pc >> 8 and builder.size:
+                break
+            instruction = Instruction.instructions.get(builder.fetch8())
+            cycles = None if instruction is None else instruction.translate(builder)
+            if cycles is None:
+                builder.pc = start
+                break
+            builder.end_instruction(cycles)
+        end = builder.pc if builder.pc > pc else pc + 1
+        for page in range(pc >> 8, ((end - 1) >> 8) + 1):
+            self._watch(key, page)
+        if not builder.size:
+            # left to the interpreter, remembered so it is not decoded again
+            return None
+        name = f'block_{bank & 0xFFFF:04X}_{pc:04X}'
+        scope = dict(self._globals, **builder.flag_ops)
+        exec(compile(builder.source(name), f'<{name}>', 'exec'), scope)
+        return scope[name]
+
+    def _watch(self, key: Tuple[int, int], page: int):
+        if key in self._page_blocks[page]:
+            return
+        if not self._page_blocks[page]:
+            self._bus.watch_writes(page=page, onwrite=self.invalidate)
+        self._page_blocks[page].add(key)
+
+    def clear(self):
+        for page in self._page_blocks:
+            self._bus.unwatch_writes(page=page, onwrite=self.invalidate)
+        self._blocks.clear()
+        self._page_blocks.clear()
+
+    def invalidate(self, address: int):
+        page = address >> 8
+        for key in self._page_blocks.pop(page, ()):
+            self._blocks.pop(key, None)
+        self._bus.unwatch_writes(page=page, onwrite=self.invalidate)
@@ -0,0 +1,183 @@
+import numpy as np
+from collections import deque
+from pygb.apu import APU
+from pygb.bus import Bus
+from pygb.ppu import PPU
+from typing import Deque, Dict, List, Set, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.motherboard import Motherboard
+
+FRAME_RATE = APU.cpu_frequency / (PPU.LINES * PPU.LINE_CYCLES)
+
+
+class Delta:
+    # a state xor'ed with the one before it, kept as runs of the bytes that changed
+
+    def __init__(self, *, starts: np.ndarray, lengths: np.ndarray, data: np.ndarray):
+        self._starts = starts
+        self._lengths = lengths
+        self._data = data
+
+    @classmethod
+    def encode(cls, previous: np.ndarray, current: np.ndarray, ranges: List[Tuple[int, int]]) -> "Delta":
+        # ranges are sorted and only cover what may have changed, the rest is never looked at
+        changed = np.concatenate([np.flatnonzero(previous[start:end] != current[start:end]) + start
+                                  for start, end in ranges])
+        breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+        starts = changed[np.r_[0, breaks]] if changed.size else changed
+        lengths = np.diff(np.r_[0, breaks, changed.size]) if changed.size else changed
+        return cls(starts=starts.astype(np.uint32), lengths=lengths.astype(np.uint32),
+                   data=previous[changed] ^ current[changed])
+
+    @property
+    def size(self) -> int:
+        return self._starts.nbytes + self._lengths.nbytes + self._data.nbytes
+
+    def apply(self, state: np.ndarray):
+        # xor is its own inverse, so the same delta moves a state either way
+        if not self._data.size:
+            return
+        starts, lengths = self._starts.astype(np.intp), self._lengths.astype(np.intp)
+        run_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + np.arange(self._data.size) - run_offsets
+        state[positions] ^= self._data
+
+
+class Segment:
+    # a keyframe and the deltas of the frames that follow it, evicted together
+
+    def __init__(self, *, keyframe: np.ndarray):
+        self.keyframe = keyframe
+        self.deltas: List[Delta] = []
+        self.size = keyframe.nbytes
+
+    @property
+    def frames(self) -> int:
+        return 1 + len(self.deltas)
+
+
+class Rewind:
+
+    def __init__(self, *, motherboard: "Motherboard", seconds: float=10.0, keyframe_interval: int=60,
+                 budget: int=64 * 1024 * 1024):
+        self._motherboard = motherboard
+        self._bus = motherboard.bus
+        self._max_frames = max(1, int(seconds * FRAME_RATE))
+        self._keyframe_interval = keyframe_interval
+        self._budget = budget
+        self._segments: Deque[Segment] = deque()
+        self._size = 0
+        self._frames = 0
+        self._previous: np.ndarray = None
+        # end of every chunk of the state that is diffed as a whole, keyed by where it starts, none overlap
+        self._chunks: Dict[int, int] = {}
+        # the cpu state, io registers and picture change behind the bus's back every frame, so they are always diffed
+        self._always: List[int] = []
+        self._page_chunks: Dict[int, int] = {}
+        regions = motherboard.state_regions
+        for name in ('parts', 'io', 'framebuffer'):
+            self._always.append(self._chunk(*regions[name]))
+        for name, start, end, mirror in (('vram', Bus.VRAM_START, Bus.EXRAM_START, Bus.VRAM_START),
+                                         ('wram', Bus.WRAM_START, Bus.ECHO_START, Bus.WRAM_START),
+                                         ('wram', Bus.ECHO_START, Bus.OAM_START, Bus.ECHO_START),
+                                         ('oam', Bus.OAM_START, Bus.IO_START, Bus.OAM_START)):
+            offset = regions[name][0]
+            for address in range(start, end, Bus.PAGE_SIZE):
+                self._page_chunks[address >> Bus.PAGE_SHIFT] = self._chunk(offset + address - mirror, Bus.PAGE_SIZE)
+        if 'cart_ram' in regions:
+            # banked, a write through the window could land anywhere in it
+            chunk = self._chunk(*regions['cart_ram'])
+            for address in range(Bus.EXRAM_START, Bus.WRAM_START, Bus.PAGE_SIZE):
+                self._page_chunks[address >> Bus.PAGE_SHIFT] = chunk
+        self._dirty: Set[int] = set()
+        for page in self._page_chunks:
+            self._bus.watch_writes(page=page, onwrite=self._onwrite)
+
+    def _chunk(self, offset: int, size: int) -> int:
+        self._chunks[offset] = offset + size
+        return offset
+
+    def _onwrite(self, address: int):
+        # only the first write to a page in a frame is seen, the page goes back to full speed after it
+        page = address >> Bus.PAGE_SHIFT
+        self._dirty.add(page)
+        self._bus.unwatch_writes(page=page, onwrite=self._onwrite)
+
+    def _rewatch(self):
+        for page in self._dirty:
+            self._bus.watch_writes(page=page, onwrite=self._onwrite)
+        self._dirty.clear()
+
+    @property
+    def frames(self) -> int:
+        return self._frames
+
+    @property
+    def seconds(self) -> float:
+        return self._frames / FRAME_RATE
+
+    @property
+    def memory(self) -> int:
+        return self._size
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self._size / self.seconds if self._frames else 0.0
+
+    def capture(self):
+        # called once per frame, it stores the state the motherboard is in now
+        current = np.frombuffer(self._motherboard.save_state(), dtype=np.uint8)
+        if self._previous is None or self._segments[-1].frames >= self._keyframe_interval:
+            segment = Segment(keyframe=current)
+            self._segments.append(segment)
+            self._size += segment.size
+        else:
+            chunks = sorted(set(self._always).union(self._page_chunks[page] for page in self._dirty))
+            delta = Delta.encode(self._previous, current, [(chunk, self._chunks[chunk]) for chunk in chunks])
+            self._segments[-1].deltas.append(delta)
+            self._segments[-1].size += delta.size
+            self._size += delta.size
+        self._frames += 1
+        self._previous = current
+        self._rewatch()
+        while len(self._segments) > 1 and (self._size > self._budget or self._frames > self._max_frames):
+            segment = self._segments.popleft()
+            self._size -= segment.size
+            self._frames -= segment.frames
+
+    def rewind(self, frames: int=1) -> int:
+        # restores the capture that many frames before the newest one and forgets everything after it
+        if not self._frames:
+            return 0
+        frames = min(frames, self._frames - 1)
+        target = self._frames - 1 - frames
+        while target < self._frames - self._segments[-1].frames:
+            segment = self._segments.pop()
+            self._size -= segment.size
+            self._frames -= segment.frames
+        segment = self._segments[-1]
+        keep = target - (self._frames - segment.frames)
+        state = segment.keyframe.copy()
+        for delta in segment.deltas[:keep]:
+            delta.apply(state)
+        for delta in segment.deltas[keep:]:
+            segment.size -= delta.size
+            self._size -= delta.size
+        del segment.deltas[keep:]
+        self._frames = target + 1
+        self._motherboard.load_state(state.data)
+        self._previous = state
+        self._rewatch()
+        return frames
+
+    def reset(self):
+        # history is only valid while every change went through the motherboard, after loading
+        # a state from elsewhere it starts over with a keyframe
+        self._segments.clear()
+        self._size = self._frames = 0
+        self._previous = None
+        self._rewatch()
+
+    def close(self):
+        for page in self._page_chunks:
+            self._bus.unwatch_writes(page=page, onwrite=self._onwrite)
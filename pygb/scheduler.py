@@ -0,0 +1,56 @@
+import heapq
+from typing import Callable, List
+
+
+class Event:
+
+    def __init__(self, *, at: int, seq: int, callback: Callable[[int], None]):
+        self.at = at
+        self.seq = seq
+        self.callback = callback
+
+    def __lt__(self, other: "Event") -> bool:
+        return (self.at, self.seq) < (other.at, other.seq)
+
+
+class Scheduler:
+
+    # deadline reported while nothing is scheduled
+    IDLE = float('inf')
+
+    def __init__(self):
+        self._events: List[Event] = []
+        self._seq = 0
+        # cycle of the earliest pending event, may be stale-early after a cancel
+        self.deadline = self.IDLE
+
+    def _update_deadline(self):
+        events = self._events
+        while events and events[0].callback is None:
+            heapq.heappop(events)
+        self.deadline = events[0].at if events else self.IDLE
+
+    def schedule(self, *, at: int, callback: Callable[[int], None]) -> Event:
+        event = Event(at=at, seq=self._seq, callback=callback)
+        self._seq += 1
+        heapq.heappush(self._events, event)
+        if at < self.deadline:
+            self.deadline = at
+        return event
+
+    def expire(self):
+        # hands control back to the run loop after the current instruction, run_due recomputes the deadline
+        self.deadline = 0
+
+    def cancel(self, event: Event):
+        # left in the heap and skipped once it reaches the top
+        event.callback = None
+
+    def run_due(self, ticks: int):
+        events = self._events
+        while events and events[0].at <= ticks:
+            event = heapq.heappop(events)
+            if event.callback is not None:
+                callback, event.callback = event.callback, None
+                callback(event.at)
+        self._update_deadline()
@@ -0,0 +1,44 @@
+from sdl2 import *
+import numpy as np
+from pygb.apu import AudioRing, AudioSink
+
+
+class SDLAudioSink(AudioSink):
+
+    def __init__(self, *, sample_rate: int, channels: int, buffer_size: int=512, ring_size: int=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.buffer_size = buffer_size
+        self._ring = AudioRing(capacity=ring_size or buffer_size * channels * 4)
+        self._init_sdl()
+
+    @property
+    def underruns(self) -> int:
+        return self._ring.underruns
+
+    @property
+    def overruns(self) -> int:
+        return self._ring.overruns
+
+    def _init_sdl(self):
+        if SDL_Init(SDL_INIT_AUDIO) < 0:
+            print('Audio initialization failed')
+        self._callback = SDL_AudioCallback(lambda userdata, buffer, length: self._sdl_callback(userdata, buffer, length))
+        self.want_audio_spec = SDL_AudioSpec(self.sample_rate, AUDIO_S8, self.channels, self.buffer_size,
+                                             callback=self._callback)
+        self.have_audio_spec = SDL_AudioSpec(0, 0, 0, 0)
+        self.audio_device = SDL_OpenAudioDevice(None, 0, self.want_audio_spec, self.have_audio_spec, 0)
+        SDL_PauseAudioDevice(self.audio_device, 0)
+
+    def _sdl_callback(self, userdata, buffer, length):
+        self._ring.read_into(buffer, length)
+
+    def write(self, frames: np.ndarray):
+        self._ring.write(frames)
+
+    def _close_sdl(self):
+        SDL_CloseAudioDevice(self.audio_device)
+        SDL_Quit()
+
+    def close(self):
+        self._close_sdl()
@@ -0,0 +1,34 @@
+from pygb.interrupts import Interrupts
+from pygb.io import IO
+from typing import Callable, List
+
+
+class Serial:
+
+    SB = 0x01
+    SC = 0x02
+
+    # transfer start and internal clock, the only transfer a lone gameboy can complete
+    START_INTERNAL = 0x81
+
+    def __init__(self, *, io: IO, interrupts: Interrupts):
+        self._io = io
+        self._interrupts = interrupts
+        self.output = bytearray()
+        self._listeners: List[Callable[[int], None]] = []
+        io.register(address=self.SC, write=self._write_sc)
+
+    def listen(self, listener: Callable[[int], None]):
+        self._listeners.append(listener)
+
+    def _write_sc(self, value: int):
+        if value & self.START_INTERNAL != self.START_INTERNAL:
+            return
+        # nothing is plugged in, the byte leaves at once and the line reads back all ones
+        byte = self._io.read8(self.SB)
+        self.output.append(byte)
+        self._io.poke8(self.SB, 0xFF)
+        self._io.poke8(self.SC, value & 0x7F)
+        self._interrupts.request(Interrupts.SERIAL)
+        for listener in self._listeners:
+            listener(byte)
@@ -0,0 +1,114 @@
+import struct
+from pygb.interrupts import Interrupts
+from pygb.io import IO
+from pygb.scheduler import Event, Scheduler
+from typing import Callable
+
+
+class Timer:
+
+    DIV = 0x04
+    TIMA = 0x05
+    TMA = 0x06
+    TAC = 0x07
+
+    TAC_ENABLE = 0x04
+    # cycles per tima increment for each clock select, tima counts falling edges of that bit of the divider
+    PERIODS = (1024, 16, 64, 256)
+
+    # cycle the divider was zero on, before 0 when it started part way, tima, the cycle it was stamped on, tma and tac
+    state_struct = struct.Struct('<qBQ2B')
+
+    def __init__(self, *, io: IO, interrupts: Interrupts, scheduler: Scheduler, clock: Callable[[], int]):
+        # nothing counts per cycle, registers are worked out from the cycle count when read
+        self._interrupts = interrupts
+        self._scheduler = scheduler
+        self._clock = clock
+        self._divider_reset = 0
+        self._tima = 0x00
+        self._tima_stamp = 0
+        self._tma = 0x00
+        self._tac = 0x00
+        self._overflow_event: Event = None
+        io.register(address=self.DIV, read=self._read_div, write=self._write_div, clocked=True)
+        io.register(address=self.TIMA, read=self._read_tima, write=self._write_tima, clocked=True)
+        io.register(address=self.TMA, read=self._read_tma, write=self._write_tma)
+        io.register(address=self.TAC, read=self._read_tac, write=self._write_tac)
+
+    def get_state(self) -> tuple:
+        return self._divider_reset, self._tima, self._tima_stamp, self._tma, self._tac
+
+    def set_state(self, state: tuple):
+        self._divider_reset, self._tima, self._tima_stamp, self._tma, self._tac = state
+        self._schedule_overflow()
+
+    def reset_divider(self, *, counter: int=0):
+        # starts the internal 16 bit counter over from the given value
+        now = self._clock()
+        self._tima = self._tima_at(now)
+        self._tima_stamp = now
+        self._divider_reset = now - counter
+        self._schedule_overflow()
+
+    def _increments(self, start: int, end: int) -> int:
+        # falling edges of the selected divider bit between two cycles
+        if not self._tac & self.TAC_ENABLE:
+            return 0
+        period = self.PERIODS[self._tac & 0x03]
+        return (end - self._divider_reset) // period - (start - self._divider_reset) // period
+
+    def _tima_at(self, now: int) -> int:
+        value = self._tima + self._increments(self._tima_stamp, now)
+        if value < 0x100:
+            return value
+        # only seen between the overflow and its event, which reloads tma
+        return self._tma + (value - 0x100) % (0x100 - self._tma)
+
+    def _schedule_overflow(self):
+        if self._overflow_event is not None:
+            self._scheduler.cancel(self._overflow_event)
+            self._overflow_event = None
+        if not self._tac & self.TAC_ENABLE:
+            return
+        period = self.PERIODS[self._tac & 0x03]
+        counter = self._tima_stamp - self._divider_reset
+        at = self._divider_reset + (counter // period + 0x100 - self._tima) * period
+        self._overflow_event = self._scheduler.schedule(at=at, callback=self._overflow)
+
+    def _overflow(self, at: int):
+        self._overflow_event = None
+        self._tima = self._tma
+        self._tima_stamp = at
+        self._interrupts.request(Interrupts.TIMER)
+        self._schedule_overflow()
+
+    def _read_div(self) -> int:
+        return (self._clock() - self._divider_reset) >> 8 & 0xFF
+
+    def _write_div(self, value: int):
+        # any write clears the whole counter
+        self.reset_divider()
+
+    def _read_tima(self) -> int:
+        return self._tima_at(self._clock())
+
+    def _write_tima(self, value: int):
+        self._tima = value
+        self._tima_stamp = self._clock()
+        self._schedule_overflow()
+
+    def _read_tma(self) -> int:
+        return self._tma
+
+    def _write_tma(self, value: int):
+        self._tma = value
+
+    def _read_tac(self) -> int:
+        return 0xF8 | self._tac
+
+    def _write_tac(self, value: int):
+        now = self._clock()
+        self._tima = self._tima_at(now)
+        self._tima_stamp = now
+        self._tac = value & 0x07
+        self._schedule_overflow()
@@ -0,0 +1,74 @@
+import struct
+from typing import List, TextIO, TYPE_CHECKING
+if TYPE_CHECKING:
+    from pygb.cpu import CPU
+
+
+class Tracer:
+    # cpu state before each instruction, in the gameboy-doctor log format
+    line_format = 'A:{:02X} F:{:02X} B:{:02X} C:{:02X} D:{:02X} E:{:02X} H:{:02X} L:{:02X} ' \
+                  'SP:{:04X} PC:{:04X} PCMEM:{:02X},{:02X},{:02X},{:02X}\n'
+
+    @staticmethod
+    def capture(cpu: "CPU") -> tuple:
+        pc = cpu.reg_pc
+        return (cpu.reg_a, cpu.reg_f, cpu.reg_b, cpu.reg_c, cpu.reg_d, cpu.reg_e, cpu.reg_h, cpu.reg_l,
+                cpu.reg_sp, pc, cpu.peek8(pc), cpu.peek8((pc + 1) & 0xFFFF),
+                cpu.peek8((pc + 2) & 0xFFFF), cpu.peek8((pc + 3) & 0xFFFF))
+
+    def record(self, cpu: "CPU"):
+        pass
+
+    def dump(self, stream: TextIO):
+        pass
+
+    def close(self):
+        pass
+
+
+class RingTracer(Tracer):
+
+    record_struct = struct.Struct('<8B2H4B')
+
+    def __init__(self, *, size: int=4096):
+        self._size = size
+        self._records = bytearray(size * self.record_struct.size)
+        self._count = 0
+
+    def record(self, cpu: "CPU"):
+        self.record_struct.pack_into(self._records, (self._count % self._size) * self.record_struct.size,
+                                     *self.capture(cpu))
+        self._count += 1
+
+    def lines(self) -> List[str]:
+        first = max(0, self._count - self._size)
+        return [self.line_format.format(*self.record_struct.unpack_from(
+                    self._records, (index % self._size) * self.record_struct.size))
+                for index in range(first, self._count)]
+
+    def dump(self, stream: TextIO):
+        stream.writelines(self.lines())
+
+
+class FileTracer(Tracer):
+
+    def __init__(self, *, path: str, batch_size: int=4096):
+        self._file = open(path, 'w')
+        self._batch_size = batch_size
+        self._lines: List[str] = []
+
+    def record(self, cpu: "CPU"):
+        self._lines.append(self.line_format.format(*self.capture(cpu)))
+        if len(self._lines) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        self._file.writelines(self._lines)
+        self._lines.clear()
+
+    def dump(self, stream: TextIO):
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
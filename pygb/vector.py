@@ -0,0 +1,176 @@
+import multiprocessing
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+from pygb.batch import FRAME_CYCLES
+from pygb.motherboard import Motherboard
+from pygb.ppu import PPU
+from typing import List, Sequence, Tuple
+
+# bit of each button in an action
+BUTTONS = ('right', 'left', 'up', 'down', 'a', 'b', 'select', 'start')
+
+
+class EmulatorGroup:
+    # a run of consecutive instances, stepped together in one process
+
+    def __init__(self, *, rom: str, start: int, count: int, ram_start: int, ram_size: int, fast_boot: bool,
+                 frames: np.ndarray, ram: np.ndarray):
+        self._rom = rom
+        self._start = start
+        self._count = count
+        self._ram_start = ram_start
+        self._ram_size = ram_size
+        self._fast_boot = fast_boot
+        self._frames = frames
+        self._ram = ram
+        self._motherboards: List[Motherboard] = []
+        self._actions = np.zeros(count, dtype=np.uint8)
+
+    def reset(self):
+        self.close()
+        self._motherboards = [Motherboard(headless=True, fast_boot=self._fast_boot, rom=self._rom)
+                              for _ in range(self._count)]
+        self._actions[:] = 0
+        self._observe()
+
+    def step(self, actions: np.ndarray):
+        # takes the actions of the whole batch and picks out its own
+        actions = actions[self._start:self._start + self._count]
+        for index, motherboard in enumerate(self._motherboards):
+            self._apply(motherboard, int(self._actions[index]), int(actions[index]))
+            motherboard.run_for(cycles=FRAME_CYCLES)
+        self._actions[:] = actions
+        self._observe()
+
+    @staticmethod
+    def _apply(motherboard: Motherboard, previous: int, action: int):
+        changed = previous ^ action
+        if not changed:
+            return
+        joypad = motherboard.joypad
+        for bit, button in enumerate(BUTTONS):
+            if changed >> bit & 1:
+                if action >> bit & 1:
+                    joypad.press(button)
+                else:
+                    joypad.release(button)
+
+    def _observe(self):
+        for index, motherboard in enumerate(self._motherboards, self._start):
+            self._frames[index] = motherboard.ppu.framebuffer
+            self._ram[index] = np.frombuffer(motherboard.bus.peek(address=self._ram_start, size=self._ram_size),
+                                             dtype=np.uint8)
+
+    def close(self):
+        for motherboard in self._motherboards:
+            motherboard.close()
+        self._motherboards = []
+
+
+def _serve(connection: Connection, name: str, shape: Tuple[int, int], group: dict):
+    # worker loop, every message from the parent is answered once this group's rows are written
+    memory = shared_memory.SharedMemory(name=name)
+    count, ram_size = shape
+    frames = np.ndarray((count, PPU.HEIGHT, PPU.WIDTH), dtype=np.uint8, buffer=memory.buf)
+    ram = np.ndarray((count, ram_size), dtype=np.uint8, buffer=memory.buf, offset=frames.nbytes)
+    emulators = EmulatorGroup(frames=frames, ram=ram, **group)
+    try:
+        while True:
+            command, actions = connection.recv()
+            if command == 'close':
+                break
+            try:
+                if command == 'reset':
+                    emulators.reset()
+                else:
+                    emulators.step(actions)
+            except Exception as e:
+                connection.send(str(e))
+            else:
+                connection.send(None)
+    finally:
+        emulators.close()
+        del frames, ram, emulators
+        memory.close()
+        connection.close()
+
+
+class VectorEnv:
+
+    def __init__(self, *, rom: str, count: int, workers: int=0, ram_start: int=0xC000, ram_size: int=0x2000,
+                 fast_boot: bool=True):
+        # with no workers every instance runs in this process, otherwise they are split evenly between them
+        self.count = count
+        self._connections: List[Connection] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._groups: List[EmulatorGroup] = []
+        self._memory: shared_memory.SharedMemory = None
+        size = count * (PPU.HEIGHT * PPU.WIDTH + ram_size)
+        if workers:
+            resource_tracker.ensure_running()
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+            buffer = self._memory.buf
+        else:
+            buffer = bytearray(size)
+        self.frames = np.ndarray((count, PPU.HEIGHT, PPU.WIDTH), dtype=np.uint8, buffer=buffer)
+        self.ram = np.ndarray((count, ram_size), dtype=np.uint8, buffer=buffer, offset=self.frames.nbytes)
+        settings = {'rom': rom, 'ram_start': ram_start, 'ram_size': ram_size, 'fast_boot': fast_boot}
+        if not workers:
+            self._groups.append(EmulatorGroup(start=0, count=count, frames=self.frames, ram=self.ram, **settings))
+            return
+        bounds = np.linspace(0, count, min(workers, count) + 1, dtype=int)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            group = dict(settings, start=int(start), count=int(end - start))
+            process = multiprocessing.Process(target=_serve, args=(child, self._memory.name, (count, ram_size), group),
+                                              daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def __enter__(self) -> "VectorEnv":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _broadcast(self, command: str, actions: np.ndarray):
+        # every worker gets the whole batch and is waited for before the step returns, which keeps them in lock step
+        for connection in self._connections:
+            connection.send((command, actions))
+        errors = [error for error in (connection.recv() for connection in self._connections) if error is not None]
+        if errors:
+            raise Exception(errors[0])
+
+    def reset(self) -> Tuple[np.ndarray, np.ndarray]:
+        for group in self._groups:
+            group.reset()
+        self._broadcast('reset', None)
+        return self.frames, self.ram
+
+    def step(self, actions: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        # one frame for every instance, the returned arrays are overwritten by the next step
+        actions = np.asarray(actions, dtype=np.uint8)
+        if actions.shape != (self.count,):
+            raise Exception(f'Expected {self.count} actions, got {actions.shape}')
+        for group in self._groups:
+            group.step(actions)
+        self._broadcast('step', actions)
+        return self.frames, self.ram
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(('close', None))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        for group in self._groups:
+            group.close()
+        self._connections, self._processes, self._groups = [], [], []
+        if self._memory is not None:
+            self.frames = self.ram = None
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
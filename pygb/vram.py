@@ -1,13 +1,38 @@
+from typing import List, Set
+
+
 class VRAM:
 
+    TILE_DATA_END = 0x1800
+    TILE_COUNT = 384
+
     def __init__(self):
         self._memory: bytearray = bytearray([0] * (0xA000 - 0x8000))
+        self._dirty_tiles: Set[int] = set(range(self.TILE_COUNT))
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._memory)
 
     def read(self, *, address: int, size: int=1) -> bytearray:
         return self._memory[address: address + size]
 
     def write(self, *, address: int, value: bytes):
-        current_address = address
-        for byte in value:
-            self._memory[current_address] = byte
-            current_address += 1
+        end = address + len(value)
+        self._memory[address:end] = value
+        # the tile cache is told about the whole range once
+        if address < self.TILE_DATA_END:
+            self._dirty_tiles.update(range(address >> 4, ((min(end, self.TILE_DATA_END) - 1) >> 4) + 1))
+
+    def write8(self, address: int, value: int):
+        self._memory[address] = value
+        if address < self.TILE_DATA_END:
+            self._dirty_tiles.add(address >> 4)
+
+    def invalidate(self):
+        self._dirty_tiles.update(range(self.TILE_COUNT))
+
+    def take_dirty_tiles(self) -> List[int]:
+        tiles = list(self._dirty_tiles)
+        self._dirty_tiles.clear()
+        return tiles
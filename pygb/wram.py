@@ -0,0 +1,16 @@
+class WRAM:
+
+    SIZE = 0x2000
+
+    def __init__(self):
+        self._memory: bytearray = bytearray([0] * self.SIZE)
+
+    @property
+    def memory(self) -> memoryview:
+        return memoryview(self._memory)
+
+    def read(self, *, address: int, size: int=1) -> bytearray:
+        return self._memory[address: address + size]
+
+    def write(self, *, address: int, value: bytes):
+        self._memory[address: address + len(value)] = value